@@ -0,0 +1,118 @@
+"""
+Serialized user profiles and user search results in the Django cache, for
+the list and profile endpoints.
+
+Profiles are cached as UserProfileSerializer data without a request, so the
+avatar URL is relative, and stamped with a per-user version that is bumped
+when the user is saved (signal_handlers). is_online/last_seen_at change on
+every connect and are taken from presence when the response is built.
+
+Search results are the ordered ids of every match, shared by all callers;
+the requester is left out per request. Their keys carry a version that is
+bumped whenever a user is created, deleted or has a searchable field saved.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import serializers as drf_serializers
+
+from apps.accounts import presence
+from . import models, serializers
+
+PROFILE_KEY = "accounts:profile:{user_id}"
+PROFILE_VERSION_KEY = "accounts:profile:{user_id}:version"
+SEARCH_VERSION_KEY = "accounts:search:version"
+SEARCH_KEY = "accounts:search:{version}:{digest}"
+# cached in place of the ids of a search with too many results
+TOO_MANY = "too_many"
+
+# fields UserListAPIView searches and the profile fields they are cached with
+SEARCH_FIELDS = frozenset(models.User.SEARCH_DOCUMENT_FIELDS)
+PROFILE_FIELDS = frozenset(serializers.UserProfileSerializer.Meta.fields)
+
+
+def get_profiles(user_ids) -> dict:
+    """
+    Returns {user_id: profile} of the users that exist.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    found = cache.get_many(
+        [PROFILE_KEY.format(user_id=user_id) for user_id in user_ids]
+        + [PROFILE_VERSION_KEY.format(user_id=user_id) for user_id in user_ids]
+    )
+    profiles = {}
+    versions = {}
+    for user_id in user_ids:
+        # a profile a reader loaded before the user was saved carries the old version
+        versions[user_id] = found.get(PROFILE_VERSION_KEY.format(user_id=user_id), 0)
+        stamped = found.get(PROFILE_KEY.format(user_id=user_id))
+        if stamped is not None and stamped[0] == versions[user_id]:
+            profiles[user_id] = stamped[1]
+
+    missing = [user_id for user_id in user_ids if user_id not in profiles]
+    if missing:
+        loaded = {
+            user.id: dict(serializers.UserProfileSerializer(user).data)
+            for user in models.User.objects.filter(id__in=missing)
+        }
+        cache.set_many(
+            {
+                PROFILE_KEY.format(user_id=user_id): (versions[user_id], profile)
+                for user_id, profile in loaded.items()
+            },
+            settings.ACCOUNTS_PROFILE_CACHE_TTL,
+        )
+        profiles.update(loaded)
+    return profiles
+
+
+def for_response(profiles, request, fields=PROFILE_FIELDS) -> list:
+    """
+    Copies of the profiles with the given fields, live presence and absolute
+    avatar URLs.
+    """
+    live = presence.get_presence(profile["id"] for profile in profiles)
+    datetime_field = drf_serializers.DateTimeField()
+    data = []
+    for profile in profiles:
+        item = {field: value for field, value in profile.items() if field in fields}
+        if profile["id"] in live:
+            is_online, last_seen_at = live[profile["id"]]
+            item["is_online"] = is_online
+            item["last_seen_at"] = datetime_field.to_representation(last_seen_at)
+        if item.get("avatar"):
+            item["avatar"] = request.build_absolute_uri(item["avatar"])
+        data.append(item)
+    return data
+
+
+def invalidate_profile(user_id: int) -> None:
+    version_key = PROFILE_VERSION_KEY.format(user_id=user_id)
+    # versions outlive the profiles stamped with them
+    cache.add(version_key, 0, settings.ACCOUNTS_PROFILE_CACHE_TTL * 10)
+    cache.incr(version_key)
+    cache.delete(PROFILE_KEY.format(user_id=user_id))
+
+
+def get_search_ids(search: str, load_ids):
+    """
+    The ids load_ids() returns for the search, from the cache when possible.
+    Returns None when there are more than ACCOUNTS_SEARCH_CACHE_MAX_IDS, those
+    are paginated in the database.
+    """
+    version = cache.get_or_set(SEARCH_VERSION_KEY, 0, None)
+    digest = hashlib.md5(" ".join(search.lower().split()).encode()).hexdigest()
+    key = SEARCH_KEY.format(version=version, digest=digest)
+    user_ids = cache.get(key)
+    if user_ids is None:
+        user_ids = load_ids(settings.ACCOUNTS_SEARCH_CACHE_MAX_IDS + 1)
+        if len(user_ids) > settings.ACCOUNTS_SEARCH_CACHE_MAX_IDS:
+            user_ids = TOO_MANY
+        cache.set(key, user_ids, settings.ACCOUNTS_SEARCH_CACHE_TTL)
+    return None if user_ids == TOO_MANY else user_ids
+
+
+def invalidate_searches() -> None:
+    cache.add(SEARCH_VERSION_KEY, 0, None)
+    cache.incr(SEARCH_VERSION_KEY)
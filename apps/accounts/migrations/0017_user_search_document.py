@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:41
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+from django.db.models.functions import Concat, Lower
+
+
+def fill_search_documents(apps, schema_editor):
+    User = apps.get_model("accounts", "User")
+    # the same document User.save() builds
+    User.objects.update(
+        search_document=Lower(Concat(
+            "username", models.Value(" "), "first_name", models.Value(" "), "last_name", models.Value(" "), "email",
+            output_field=models.TextField(),
+        ))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_alter_userconfirmationcode_code_type'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='user',
+            name='search_document',
+            field=models.TextField(default='', editable=False, verbose_name='Search Document'),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='user',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='user_search_document_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
@@ -2,6 +2,7 @@ import re
 import secrets
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.models import UserManager as _UserManager
+from django.contrib.postgres.indexes import GinIndex
 from django.core.validators import RegexValidator, FileExtensionValidator
 from django.db import models
 from django.apps import apps
@@ -55,6 +56,26 @@ class UserManager(_UserManager):
         extra_fields.setdefault("is_superuser", False)
         return self._create_user(username, email, password, **extra_fields)
 
+    def search(self, query: str) -> list:
+        """
+        Users whose search_document contains every word of the query, as one
+        queryset per search_rank: 0 when the username starts with the query,
+        1 when another field does and 2 for matches inside a word. No index
+        serves a rank computed per row, so each rank is a filter of its own
+        and is paged on the username index.
+        """
+        query = " ".join(query.lower().split())
+        queryset = self.get_queryset()
+        for word in query.split():
+            queryset = queryset.filter(search_document__contains=word)
+        username_prefix = models.Q(search_document__startswith=query)
+        word_prefix = models.Q(search_document__contains=f" {query}")
+        ranks = (username_prefix, word_prefix & ~username_prefix, ~word_prefix & ~username_prefix)
+        return [
+            queryset.filter(rank_filter).annotate(search_rank=models.Value(search_rank))
+            for search_rank, rank_filter in enumerate(ranks)
+        ]
+
     def create_superuser(self, username, email=None, password=None, **extra_fields):
         extra_fields.setdefault("is_staff", True)
         extra_fields.setdefault("is_superuser", True)
@@ -72,6 +93,13 @@ class User(AbstractUser):
         db_table = "auth_user"
         verbose_name = "User"
         verbose_name_plural = "Users"
+        indexes = [
+            # substring matches of UserManager.search
+            GinIndex(fields=["search_document"], opclasses=["gin_trgm_ops"], name="user_search_document_trgm_idx"),
+        ]
+
+    # searched by UserSearchAPIView, in this order in search_document
+    SEARCH_DOCUMENT_FIELDS = ("username", "first_name", "last_name", "email")
 
     objects = UserManager()
 
@@ -98,12 +126,23 @@ class User(AbstractUser):
     )
     is_online = models.BooleanField(verbose_name=_("Is Online"), default=False)
     last_seen_at = models.DateTimeField(verbose_name=_("Last Seen At"), null=True, blank=True)
+    # lowercased SEARCH_DOCUMENT_FIELDS separated by spaces, kept by save()
+    search_document = models.TextField(verbose_name=_("Search Document"), editable=False, default="")
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username"]
 
     def __str__(self):
         return self.username
 
+    def save(self, *args, **kwargs):
+        self.search_document = " ".join(
+            str(getattr(self, field) or "") for field in self.SEARCH_DOCUMENT_FIELDS
+        ).lower()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and set(update_fields) & set(self.SEARCH_DOCUMENT_FIELDS):
+            kwargs["update_fields"] = {*update_fields, "search_document"}
+        super().save(*args, **kwargs)
+
     @classmethod
     def check_is_username_available(cls, username):
         if not username:
@@ -0,0 +1,88 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class UserSearchCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination over the (search_rank, username) of UserManager.search
+    rows, best match first. The cursor is the key of the last row of the page.
+
+    Pages are read rank by rank, each on the username index, and a page that
+    runs out of one rank goes on with the next, so at most one query per rank.
+    """
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        queryset is the list of querysets UserManager.search returns, one per rank.
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+
+        search_rank, username = self.decode_cursor(request) or (0, None)
+        page = []
+        for rank_queryset in queryset[search_rank:]:
+            if username is not None:
+                rank_queryset = rank_queryset.filter(username__gt=username)
+                username = None
+            page.extend(rank_queryset.order_by("username")[:self.limit + 1 - len(page)])
+            if len(page) > self.limit:
+                break
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            search_rank, username = urlsafe_b64decode(encoded.encode("ascii")).decode("utf-8").split(",", 1)
+            search_rank = int(search_rank)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if search_rank < 0:
+            raise NotFound(self.invalid_cursor_message)
+        return search_rank, username
+
+    def encode_cursor(self, row):
+        cursor = f"{row['search_rank']},{row['username']}"
+        return urlsafe_b64encode(cursor.encode("utf-8")).decode("ascii")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
@@ -0,0 +1,154 @@
+"""
+Online presence kept in Redis.
+
+Every open websocket holds a reference on the user's connection counter and
+sends a heartbeat every PRESENCE_HEARTBEAT_INTERVAL seconds while it is open;
+the counter expires after PRESENCE_TTL seconds without a heartbeat, so crashed
+workers do not leave users online forever. is_online/last_seen_at are written
+back to auth_user by flush() in batched UPDATEs instead of a User.save() per
+connect and disconnect.
+"""
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import models
+
+from apps.common.redis_client import get_redis, get_async_redis
+
+CONNECTIONS_KEY = "presence:connections:{user_id}"
+# sorted set user_id -> unix time the presence expires at
+ONLINE_KEY = "presence:online"
+# hash user_id -> unix time the user was last seen
+LAST_SEEN_KEY = "presence:last_seen"
+# user ids whose state changed since the last flush
+DIRTY_KEY = "presence:dirty"
+
+FLUSH_BATCH_SIZE = 500
+
+DISCONNECT_SCRIPT = """
+local connections = redis.call('DECR', KEYS[1])
+if connections <= 0 then
+    redis.call('DEL', KEYS[1])
+    redis.call('ZREM', KEYS[2], ARGV[1])
+end
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+redis.call('SADD', KEYS[4], ARGV[1])
+return connections
+"""
+
+# puts the user back into ONLINE_KEY after flush() pruned it, as long as a
+# connection is held; returns 0 when the counter expired
+HEARTBEAT_SCRIPT = """
+local connections = tonumber(redis.call('GET', KEYS[1]) or '0')
+if connections <= 0 then
+    return 0
+end
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+if redis.call('ZADD', KEYS[2], ARGV[2] + ARGV[3], ARGV[1]) == 1 then
+    redis.call('SADD', KEYS[4], ARGV[1])
+end
+redis.call('HSET', KEYS[3], ARGV[1], ARGV[2])
+return connections
+"""
+
+
+async def connect(user_id: int) -> None:
+    now = time.time()
+    connections_key = CONNECTIONS_KEY.format(user_id=user_id)
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.incr(connections_key)
+        pipe.expire(connections_key, settings.PRESENCE_TTL)
+        pipe.zadd(ONLINE_KEY, {user_id: now + settings.PRESENCE_TTL})
+        pipe.hset(LAST_SEEN_KEY, user_id, now)
+        pipe.sadd(DIRTY_KEY, user_id)
+        await pipe.execute()
+
+
+async def heartbeat(user_id: int) -> bool:
+    """
+    Returns False when the user's connection counter had already expired, the
+    connection has to connect() again.
+    """
+    connections = await get_async_redis().eval(
+        HEARTBEAT_SCRIPT, 4,
+        CONNECTIONS_KEY.format(user_id=user_id), ONLINE_KEY, LAST_SEEN_KEY, DIRTY_KEY,
+        user_id, time.time(), settings.PRESENCE_TTL,
+    )
+    return connections > 0
+
+
+async def disconnect(user_id: int) -> None:
+    await get_async_redis().eval(
+        DISCONNECT_SCRIPT, 4,
+        CONNECTIONS_KEY.format(user_id=user_id), ONLINE_KEY, LAST_SEEN_KEY, DIRTY_KEY,
+        user_id, time.time(),
+    )
+
+
+async def is_online(user_id: int) -> bool:
+    expires_at = await get_async_redis().zscore(ONLINE_KEY, user_id)
+    return expires_at is not None and expires_at > time.time()
+
+
+def get_presence(user_ids) -> dict:
+    """
+    Returns {user_id: (is_online, last_seen_at)} for the users Redis knows about.
+    """
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    now = time.time()
+    pipe = get_redis().pipeline(transaction=False)
+    pipe.zmscore(ONLINE_KEY, user_ids)
+    pipe.hmget(LAST_SEEN_KEY, user_ids)
+    expires, last_seen = pipe.execute()
+
+    presence = {}
+    for user_id, expires_at, seen_at in zip(user_ids, expires, last_seen):
+        if seen_at is None:
+            continue
+        presence[user_id] = (
+            expires_at is not None and expires_at > now,
+            datetime.fromtimestamp(float(seen_at), tz=dt_timezone.utc),
+        )
+    return presence
+
+
+def flush() -> int:
+    """
+    Write presence changes since the last flush to auth_user. Returns the number
+    of users updated.
+    """
+    from apps.accounts.models import User
+
+    client = get_redis()
+    now = time.time()
+    expired = client.zrangebyscore(ONLINE_KEY, "-inf", now)
+
+    pipe = client.pipeline(transaction=True)
+    pipe.zremrangebyscore(ONLINE_KEY, "-inf", now)
+    if expired:
+        pipe.sadd(DIRTY_KEY, *expired)
+    pipe.smembers(DIRTY_KEY)
+    pipe.delete(DIRTY_KEY)
+    dirty = pipe.execute()[-2]
+
+    user_ids = sorted(int(user_id) for user_id in dirty)
+    presence = get_presence(user_ids)
+    updated = 0
+    for start in range(0, len(user_ids), FLUSH_BATCH_SIZE):
+        batch = [user_id for user_id in user_ids[start:start + FLUSH_BATCH_SIZE] if user_id in presence]
+        if not batch:
+            continue
+        updated += User.objects.filter(id__in=batch).update(
+            is_online=models.Case(
+                *[models.When(id=user_id, then=models.Value(presence[user_id][0])) for user_id in batch],
+                output_field=models.BooleanField(),
+            ),
+            last_seen_at=models.Case(
+                *[models.When(id=user_id, then=models.Value(presence[user_id][1])) for user_id in batch],
+                output_field=models.DateTimeField(),
+            ),
+        )
+    return updated
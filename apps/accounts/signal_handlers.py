@@ -1,9 +1,26 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
-from . import models
+from . import caches, models
 
 
 @receiver(post_save, sender=models.User)
 def create_user_account_settings(sender, instance, created, **kwargs):
     if not hasattr(instance, "account_settings"):
         models.AccountSettings.objects.create(user=instance)
+
+
+@receiver(post_save, sender=models.User)
+def invalidate_cached_user_data(sender, instance, created, update_fields=None, **kwargs):
+    # last_login, and presence written back by presence.flush, are not cached
+    changed = set(update_fields) if update_fields is not None else None
+    if changed is None or changed & caches.PROFILE_FIELDS:
+        transaction.on_commit(lambda: caches.invalidate_profile(instance.pk))
+    if created or changed is None or changed & caches.SEARCH_FIELDS:
+        transaction.on_commit(caches.invalidate_searches)
+
+
+@receiver(post_delete, sender=models.User)
+def drop_cached_user_data(sender, instance, **kwargs):
+    transaction.on_commit(lambda: caches.invalidate_profile(instance.pk))
+    transaction.on_commit(caches.invalidate_searches)
@@ -0,0 +1,8 @@
+from celery import shared_task
+
+from . import presence
+
+
+@shared_task(name="flush_presence_task", routing_key="lightweight-tasks")
+def flush_presence_task():
+    return presence.flush()
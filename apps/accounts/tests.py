@@ -1,3 +1,138 @@
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from asgiref.sync import async_to_sync
 from django.test import TestCase
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from apps.common.redis_client import get_redis
+from . import caches, presence
+from .models import User
+
+
+class UserListAndProfileCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("alice", "bob")
+        ]
+
+    def setUp(self):
+        caches.invalidate_searches()
+        for user in (self.alice, self.bob):
+            caches.invalidate_profile(user.id)
+
+    def get(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_requester_is_left_out_for_every_caller(self):
+        url = reverse("accounts:user_list")
+        self.assertEqual([user["id"] for user in self.get(self.alice, url)["results"]], [self.bob.id])
+        self.assertEqual([user["id"] for user in self.get(self.bob, url)["results"]], [self.alice.id])
+
+    def test_saved_profiles_are_not_served_stale(self):
+        url = reverse("accounts:user_profile", kwargs={"pk": self.bob.id})
+        self.assertEqual(self.get(self.alice, url)["first_name"], "")
+
+        self.bob.first_name = "Bobby"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.bob.save()
+        self.assertEqual(self.get(self.alice, url)["first_name"], "Bobby")
+
+
+class UserSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.requester = User.objects.create_user(username="annamaria", email="requester@example.com")
+        cls.infix, cls.name_prefix, cls.username_prefix = [
+            User.objects.create_user(username=username, email=f"{username}@example.com", first_name=first_name)
+            for username, first_name in (("joanna", ""), ("zed", "Annette"), ("anna_k", ""))
+        ]
+
+    def search(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.requester)
+        response = client.get(reverse("accounts:user_search"), params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_matches_rank_first_and_requester_is_left_out(self):
+        results = self.search(q="ANN")["results"]
+        self.assertEqual(
+            [user["id"] for user in results],
+            [self.username_prefix.id, self.name_prefix.id, self.infix.id],
+        )
+
+    def test_pages_follow_the_cursor(self):
+        first = self.search(q="ann", limit=2)
+        self.assertEqual(len(first["results"]), 2)
+        cursor, = parse_qs(urlsplit(first["next"]).query)["cursor"]
+        second = self.search(q="ann", limit=2, cursor=cursor)
+        self.assertEqual([user["id"] for user in second["results"]], [self.infix.id])
+        self.assertIsNone(second["next"])
+
+    def test_pages_of_one_go_through_every_rank(self):
+        ids, params = [], {"q": "ann", "limit": 1}
+        while True:
+            page = self.search(**params)
+            ids.extend(user["id"] for user in page["results"])
+            if page["next"] is None:
+                break
+            params["cursor"], = parse_qs(urlsplit(page["next"]).query)["cursor"]
+        self.assertEqual(ids, [self.username_prefix.id, self.name_prefix.id, self.infix.id])
+
+
+class PresenceTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="alice", email="alice@example.com")
+
+    def setUp(self):
+        get_redis().delete(
+            presence.CONNECTIONS_KEY.format(user_id=self.user.id),
+            presence.ONLINE_KEY, presence.LAST_SEEN_KEY, presence.DIRTY_KEY,
+        )
+
+    def is_online(self):
+        return async_to_sync(presence.is_online)(self.user.id)
+
+    def flushed_is_online(self):
+        presence.flush()
+        self.user.refresh_from_db()
+        return self.user.is_online
+
+    def test_user_stays_online_until_the_last_connection_is_closed(self):
+        async_to_sync(presence.connect)(self.user.id)
+        async_to_sync(presence.connect)(self.user.id)
+        self.assertTrue(self.flushed_is_online())
+
+        async_to_sync(presence.disconnect)(self.user.id)
+        self.assertTrue(self.is_online())
+        async_to_sync(presence.disconnect)(self.user.id)
+        self.assertFalse(self.is_online())
+        self.assertFalse(self.flushed_is_online())
+        self.assertIsNotNone(self.user.last_seen_at)
+
+    def test_heartbeat_puts_back_a_connected_user_that_flush_pruned(self):
+        async_to_sync(presence.connect)(self.user.id)
+        # the presence ran out, e.g. the worker stalled past PRESENCE_TTL
+        get_redis().zadd(presence.ONLINE_KEY, {self.user.id: time.time() - 1})
+        self.assertFalse(self.flushed_is_online())
+
+        self.assertTrue(async_to_sync(presence.heartbeat)(self.user.id))
+        self.assertTrue(self.is_online())
+        self.assertTrue(self.flushed_is_online())
+
+    def test_heartbeat_of_an_expired_connection_counter_is_refused(self):
+        async_to_sync(presence.connect)(self.user.id)
+        get_redis().delete(presence.CONNECTIONS_KEY.format(user_id=self.user.id))
+        get_redis().delete(presence.ONLINE_KEY)
 
-# Create your tests here.
+        self.assertFalse(async_to_sync(presence.heartbeat)(self.user.id))
+        self.assertFalse(self.is_online())
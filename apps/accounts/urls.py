@@ -6,9 +6,6 @@ from . import views
 app_name = 'accounts'
 
 ONE_MINUTE = 60
-FIVE_MINUTES = 60 * 10
-ONE_HOUR = 60 * 60
-TWO_HOUR = ONE_HOUR * 2
 
 urlpatterns = [
     path(
@@ -58,12 +55,17 @@ urlpatterns = [
     ),
     path(
         "list/",
-        cache_page(TWO_HOUR)(views.UserListAPIView.as_view()),
+        views.UserListAPIView.as_view(),
         name="user_list",
     ),
+    path(
+        "search/",
+        views.UserSearchAPIView.as_view(),
+        name="user_search",
+    ),
     path(
         "profile/<int:pk>/",
-        cache_page(FIVE_MINUTES)(views.UserProfileAPIView.as_view()),
+        views.UserProfileAPIView.as_view(),
         name="user_profile",
     ),
 ]
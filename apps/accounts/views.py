@@ -1,10 +1,12 @@
-from rest_framework import generics, permissions, status, views, parsers
+from django.conf import settings
+from rest_framework import exceptions, generics, permissions, status, views, parsers
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
 from apps.accounts.models import User
-from . import serializers
+from . import caches, pagination, serializers
 
 
 class UserRegisterAPIView(generics.CreateAPIView):
@@ -84,8 +86,84 @@ class UserListAPIView(generics.ListAPIView):
     def get_queryset(self):
         return self.queryset.exclude(id=self.request.user.id)
 
+    def list(self, request, *args, **kwargs):
+        """
+        Pages through the cached ids of the search and fills them in from the
+        cached profiles, see caches.
+        """
+        search = request.query_params.get(api_settings.SEARCH_PARAM, "")
+        matches = self.filter_queryset(self.queryset.order_by("id")).values_list("id", flat=True)
+        user_ids = caches.get_search_ids(search, lambda limit: list(matches[:limit]))
+        if user_ids is None:
+            user_ids = matches.exclude(id=request.user.id)
+        else:
+            user_ids = [user_id for user_id in user_ids if user_id != request.user.id]
+
+        page = self.paginate_queryset(user_ids)
+        profiles = caches.get_profiles(page)
+        data = caches.for_response(
+            [profiles[user_id] for user_id in page if user_id in profiles],
+            request,
+            fields=serializers.UserListSerializer.Meta.fields,
+        )
+        return self.get_paginated_response(data)
+
+
+user_search_manual_parameters = [
+    openapi.Parameter(
+        name="q",
+        in_=openapi.IN_QUERY,
+        type=openapi.TYPE_STRING,
+        description="Words to search usernames, names and emails for",
+        required=True,
+    ),
+]
+
+
+class UserSearchAPIView(generics.ListAPIView):
+    """
+    Users matching every word of ?q=, those whose username starts with it
+    first, then those with another field starting with it. The requester is
+    left out.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    serializer_class = serializers.UserListSerializer
+    pagination_class = pagination.UserSearchCursorPagination
+    filter_backends = ()
+
+    @swagger_auto_schema(manual_parameters=user_search_manual_parameters)
+    def get(self, request, *args, **kwargs):
+        return super().get(request, *args, **kwargs)
+
+    def get_queryset(self):
+        query = self.request.query_params.get("q", "")
+        # shorter words have no trigrams, only they would scan the whole table
+        if not any(len(word) >= settings.USER_SEARCH_MIN_LENGTH for word in query.split()):
+            raise exceptions.ValidationError(
+                {"q": f"Enter a word of at least {settings.USER_SEARCH_MIN_LENGTH} characters."}
+            )
+        return [queryset.exclude(id=self.request.user.id) for queryset in User.objects.search(query)]
+
+    def list(self, request, *args, **kwargs):
+        page = self.paginate_queryset(
+            [queryset.values("id", "username", "search_rank") for queryset in self.get_queryset()]
+        )
+        profiles = caches.get_profiles(row["id"] for row in page)
+        data = caches.for_response(
+            [profiles[row["id"]] for row in page if row["id"] in profiles],
+            request,
+            fields=serializers.UserListSerializer.Meta.fields,
+        )
+        return self.get_paginated_response(data)
+
 
 class UserProfileAPIView(generics.RetrieveAPIView):
     permission_classes = (permissions.IsAuthenticated,)
     serializer_class = serializers.UserProfileSerializer
     queryset = User.objects.all()
+
+    def retrieve(self, request, *args, **kwargs):
+        profile = caches.get_profiles([self.kwargs["pk"]]).get(self.kwargs["pk"])
+        if profile is None:
+            raise exceptions.NotFound()
+        return Response(caches.for_response([profile], request)[0])
@@ -26,6 +26,25 @@ class MessageAdmin(admin.ModelAdmin):
     list_display_links = ("id", "chat")
     search_fields = ("chat__name", "sender__username", "content")
     list_filter = ("chat", "sender", "type",)
+    # allocated on save, see save_model
+    readonly_fields = ("seq",)
+
+    def get_form(self, request, obj=None, **kwargs):
+        form = super().get_form(request, obj, **kwargs)
+        # a message without a chat has no seq to take
+        form.base_fields["chat"].required = True
+        return form
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            return super().save_model(request, obj, form, change)
+        # the same bookkeeping as db_operations.save_message_to_db, the admin
+        # runs it inside the transaction of the request
+        obj.seq = models.Chat.objects.allocate_seq(obj.chat_id)
+        super().save_model(request, obj, form, change)
+        models.Chat.objects.set_last_message(obj)
+        if not obj.chat.is_broadcast:
+            models.ChatMembership.objects.apply_new_message(obj)
 
     def short_content(self, obj):
         return obj.content[:40]
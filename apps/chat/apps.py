@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.chat'
+
+    def ready(self):
+        import apps.chat.signal_handlers
+        from apps.chat import metrics
+
+        if metrics.is_enabled():
+            metrics.install_query_counter()
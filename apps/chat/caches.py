@@ -0,0 +1,22 @@
+"""
+Users and chats the chat sockets look up on every send, see
+apps/common/cache.py. Invalidated by signal_handlers.
+"""
+from django.conf import settings
+
+from apps.accounts.models import User
+from apps.common.cache import TwoTierCache
+from . import models
+
+users = TwoTierCache(
+    "user", User,
+    maxsize=settings.CHAT_CACHE_LOCAL_MAXSIZE,
+    local_ttl=settings.CHAT_CACHE_LOCAL_TTL,
+    ttl=settings.CHAT_CACHE_TTL,
+)
+chats = TwoTierCache(
+    "chat", models.Chat,
+    maxsize=settings.CHAT_CACHE_LOCAL_MAXSIZE,
+    local_ttl=settings.CHAT_CACHE_LOCAL_TTL,
+    ttl=settings.CHAT_CACHE_TTL,
+)
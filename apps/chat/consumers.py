@@ -1,158 +1,403 @@
+import asyncio
 import json
+import logging
+import time
+from urllib.parse import parse_qs
+
+import redis
 from channels.generic.websocket import AsyncWebsocketConsumer
+from django.conf import settings
+
+from . import utils, db_operations, event_log, membership_index, metrics, typing_status, write_behind
+from apps.accounts import presence
+
+logger = logging.getLogger(__name__)
+
+# the frames BaseChatConsumer.handle_chat_event understands
+CHAT_EVENT_TYPES = frozenset(
+    event_type.value for event_type in (
+        utils.ReceiveMessageEventTypesEnum.CHECK_PRIVATE_CHAT_USER_ONLINE,
+        utils.ReceiveMessageEventTypesEnum.CHAT_SEND_MESSAGE,
+        utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_USER_TYPING_STATUS,
+        utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_SEE_MESSAGE,
+        utils.ReceiveMessageEventTypesEnum.CHAT_READ_MESSAGES,
+        utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_EDIT_MESSAGE,
+        utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_MESSAGE_DELETE,
+    )
+)
+
 
-from . import utils, db_operations
-from apps.chat.serializers import MessageDetailSerializer
+class TypingState:
+    __slots__ = ("room_group_name", "refreshed_at", "expires_at", "expiry")
 
+    def __init__(self, room_group_name):
+        self.room_group_name = room_group_name
+        self.refreshed_at = float("-inf")
+        self.expires_at = 0.0
+        self.expiry = None
+
+
+class BaseChatConsumer(AsyncWebsocketConsumer):
+    """
+    Event handling shared by the per-chat socket and the multiplexed per-user stream.
+    Every handler works on an explicit chat id and room group, so one connection
+    can serve any number of chats.
+    """
 
-class ChatConsumer(AsyncWebsocketConsumer):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-        self.room_name = "None"
-        self.room_group_name = "None"
+        # chat_id -> Chat the user was permitted to access, kept for the
+        # connection's lifetime and dropped on chat_membership_changed
+        self.permitted_chats = {}
+        self.is_presence_connected = False
+        # refreshes the presence while the connection is open, idle or not
+        self.presence_heartbeat_task = None
+        # chat_id -> last event replayed by replay_events, so group events
+        # that were queued meanwhile are not sent twice
+        self.replay_cursors = {}
+        # chat_id -> TypingState while the user is typing in that chat
+        self.typing = {}
 
-    async def connect(self):
-        if self.scope["user"].is_anonymous:
-            await self.close()
-            return
-        chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
+    async def accept(self, subprotocol=None):
+        metrics.inc(metrics.CONNECTIONS, type(self).__name__)
+        await super().accept(subprotocol=subprotocol)
+
+    async def reject(self, reason):
+        metrics.inc(metrics.REJECTIONS, type(self).__name__, reason)
+        await self.close()
+
+    async def get_permitted_chat(self, chat_id):
+        chat = self.permitted_chats.get(chat_id)
+        if chat is not None:
+            return chat
+        if not await membership_index.ais_member(chat_id, self.scope["user"].id):
+            return None
         chat = await db_operations.get_chat_by_id(chat_id)
         if chat is None:
-            await self.close()
+            return None
+        self.permitted_chats[chat_id] = chat
+        return chat
+
+    async def presence_connect(self):
+        self.is_presence_connected = True
+        await presence.connect(self.scope["user"].id)
+        self.presence_heartbeat_task = asyncio.create_task(self.presence_heartbeat())
+
+    async def presence_disconnect(self):
+        """
+        Returns whether the user is still online through another connection.
+        """
+        if not self.is_presence_connected:
+            return False
+        self.is_presence_connected = False
+        self.presence_heartbeat_task.cancel()
+        await presence.disconnect(self.scope["user"].id)
+        return await presence.is_online(self.scope["user"].id)
+
+    async def presence_heartbeat(self):
+        """
+        Keeps the presence alive every PRESENCE_HEARTBEAT_INTERVAL seconds until
+        presence_disconnect() cancels it, whether the client sends frames or not.
+        """
+        while True:
+            await asyncio.sleep(settings.PRESENCE_HEARTBEAT_INTERVAL)
+            await self.refresh_presence()
+
+    async def refresh_presence(self):
+        user_id = self.scope["user"].id
+        try:
+            if not await presence.heartbeat(user_id):
+                # the counter expired while this connection was open
+                await presence.connect(user_id)
+        except redis.RedisError:
+            logger.warning("presence heartbeat of user %s failed", user_id, exc_info=True)
+
+    async def group_send(self, room_group_name, message):
+        metrics.inc(metrics.GROUP_SENDS, message["type"])
+        await self.channel_layer.group_send(room_group_name, message)
+
+    async def group_send_event(self, room_group_name, event):
+        """
+        Send a client-facing event to the group. The event is encoded here once,
+        receiving consumers forward the encoded text untouched.
+        """
+        await self.group_send(
+            room_group_name, {
+                "type": event["type"],
+                "text": utils.encode_event(event),
+            }
+        )
+
+    async def group_send_logged_event(self, room_group_name, event):
+        """
+        group_send_event for events a reconnecting client must not miss: the
+        event goes to the chat's event log first and carries its event_id.
+        """
+        event_id = await event_log.append(event["chat_id"], event)
+        await self.group_send(
+            room_group_name, {
+                "type": event["type"],
+                "text": event_log.with_event_id(event, event_id),
+                "chat_id": event["chat_id"],
+                "event_id": event_id,
+            }
+        )
+
+    async def replay_events(self, chat_id, last_event_id):
+        """
+        Send the events of the chat logged after last_event_id, or
+        resync_required when the log does not reach back that far.
+        Call after joining the chat's group.
+        """
+        events = await event_log.read_since(chat_id, last_event_id)
+        if events is None:
+            await self.send(text_data=utils.encode_event({
+                "EVENT_TYPE": utils.SendMessageEventTypesEnum.RESYNC_REQUIRED.value,
+                "chat_id": chat_id,
+            }))
             return
+        for _, text in events:
+            await self.send(text_data=text)
+        if events:
+            self.replay_cursors[chat_id] = event_log.parse_event_id(events[-1][0])
 
-        if not await db_operations.check_chat_is_permitted(chat, self.scope["user"]):
-            await self.close()
+    async def receive(self, text_data):
+        try:
+            text_data_json = json.loads(text_data)
+        except json.JSONDecodeError:
             return
 
-        self.room_name = 'private_chat_{chat_id}'.format(chat_id=self.scope["url_route"]["kwargs"]["chat_id"])
-        self.room_group_name = "group_%s" % self.room_name
+        if not metrics.is_enabled():
+            await self.handle_frame(text_data_json)
+            return
+        with metrics.observe_event(text_data_json.get("EVENT_TYPE"), len(text_data.encode())):
+            await self.handle_frame(text_data_json)
 
-        await self.channel_layer.group_add(
-            self.room_group_name, self.channel_name
-        )
-        await self.accept()
+    async def handle_frame(self, text_data_json):
+        """
+        Handle one decoded client frame. Subclasses route the frames they
+        understand and pass anything else on to this: client heartbeats
+        refresh the presence right away, anything else is answered with an
+        error event.
+        """
+        if text_data_json.get("EVENT_TYPE") == utils.ReceiveMessageEventTypesEnum.HEARTBEAT.value:
+            if self.is_presence_connected:
+                await self.refresh_presence()
+            return
+        await self.send(text_data=utils.encode_event({
+            "EVENT_TYPE": utils.SendMessageEventTypesEnum.ERROR.value,
+            "error": "unsupported_event",
+            "event_type": text_data_json.get("EVENT_TYPE"),
+            "chat_id": text_data_json.get("chat_id"),
+        }))
 
-    async def accept(self, subprotocol=None):
-        await super().accept(subprotocol=subprotocol)
-        await db_operations.set_user_online(self.scope["user"])
-        await self.channel_layer.group_send(
-            self.room_group_name, {
+    def is_broadcast_chat(self, chat_id):
+        chat = self.permitted_chats.get(chat_id)
+        return chat is not None and chat.is_broadcast
+
+    async def send_to_chat_or_self(self, room_group_name, event, logged=False):
+        """
+        Member-level events (read receipts, online checks) of a channel only
+        go back to the member's own socket instead of every subscriber.
+        """
+        if self.is_broadcast_chat(event["chat_id"]):
+            await self.send(text_data=utils.encode_event(event))
+        elif logged:
+            await self.group_send_logged_event(room_group_name, event)
+        else:
+            await self.group_send_event(room_group_name, event)
+
+    async def broadcast_online_status(self, room_group_name, chat_id, is_online):
+        if self.is_broadcast_chat(chat_id):
+            return
+        await self.group_send_event(
+            room_group_name, {
                 "type": self.send_online_offline_event.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_ONLINE_STATUS.value,
-                "is_online": True,
+                "chat_id": chat_id,
+                "is_online": is_online,
                 "user_id": self.scope["user"].id
             }
         )
 
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name, self.channel_name
-        )
-        await db_operations.set_user_offline(self.scope["user"])
-        await self.channel_layer.group_send(
-            self.room_group_name, {
-                "type": self.send_online_offline_event.__name__,
-                "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_ONLINE_STATUS.value,
-                "is_online": False,
-                "user_id": self.scope["user"].id
+    async def broadcast_typing_status(self, room_group_name, chat_id, is_typing):
+        await self.group_send(
+            room_group_name, {
+                "type": self.send_typing_status.__name__,
+                "text": utils.encode_event({
+                    "type": self.send_typing_status.__name__,
+                    "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_USER_TYPING_STATUS.value,
+                    "chat_id": chat_id,
+                    "user_id": self.scope["user"].id,
+                    "is_typing": is_typing,
+                }),
+                "sender_channel": self.channel_name,
             }
         )
 
-    async def receive(self, text_data):
-        try:
-            text_data_json = json.loads(text_data)
-        except json.JSONDecodeError:
+    async def start_typing(self, chat_id, room_group_name):
+        """
+        Clients send a typing frame per keystroke. The connection refreshes
+        the user's status in the chat (see typing_status) at most once per
+        CHAT_TYPING_INTERVAL, "is_typing": true goes out at most once per
+        interval for all of the user's connections together, and the typing
+        stops when no typing frame came for CHAT_TYPING_TIMEOUT.
+        """
+        now = time.monotonic()
+        state = self.typing.get(chat_id)
+        if state is None:
+            state = TypingState(room_group_name)
+            self.typing[chat_id] = state
+            state.expiry = asyncio.create_task(self.expire_typing(chat_id, state))
+        state.expires_at = now + settings.CHAT_TYPING_TIMEOUT
+        if now - state.refreshed_at >= settings.CHAT_TYPING_INTERVAL:
+            state.refreshed_at = now
+            if await typing_status.refresh(chat_id, self.scope["user"].id, self.channel_name):
+                await self.broadcast_typing_status(room_group_name, chat_id, is_typing=True)
+
+    async def stop_typing(self, chat_id):
+        state = self.typing.pop(chat_id, None)
+        if state is None:
             return
+        if state.expiry is not asyncio.current_task():
+            state.expiry.cancel()
+        # another connection of the user may still be typing in the chat
+        if await typing_status.stop(chat_id, self.scope["user"].id, self.channel_name):
+            await self.broadcast_typing_status(state.room_group_name, chat_id, is_typing=False)
 
+    async def stop_all_typing(self):
+        for chat_id in list(self.typing):
+            await self.stop_typing(chat_id)
+
+    async def expire_typing(self, chat_id, state):
+        while (delay := state.expires_at - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.stop_typing(chat_id)
+
+    async def handle_chat_event(self, chat_id, room_group_name, text_data_json):
         event_type = text_data_json.get("EVENT_TYPE")
         if event_type == utils.ReceiveMessageEventTypesEnum.CHECK_PRIVATE_CHAT_USER_ONLINE.value:
-            user = await db_operations.get_user_by_pk(text_data_json["user_id"])
-            is_online = await db_operations.user_is_online(user)
+            is_online = await presence.is_online(text_data_json["user_id"])
 
             event = {
                 "type": self.send_online_offline_event.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_ONLINE_STATUS.value,
+                "chat_id": chat_id,
                 "is_online": is_online,
                 "user_id": text_data_json["user_id"]
             }
-            await self.channel_layer.group_send(
-                self.room_group_name, event
-            )
+            await self.send_to_chat_or_self(room_group_name, event)
         elif event_type == utils.ReceiveMessageEventTypesEnum.CHAT_SEND_MESSAGE.value:
-            chat_id = self.scope["url_route"]["kwargs"]["chat_id"]
             sender = self.scope["user"]
             receiver_id = text_data_json.get("receiver_id", None)
             message_type = text_data_json.get("message_type")
             message_content = text_data_json.get("message_text")
 
-            chat = await db_operations.get_chat_by_id(chat_id)
+            chat = await self.get_permitted_chat(chat_id)
+            if chat is None or not chat.can_post(sender):
+                return
+
             if receiver_id:
                 receiver = await db_operations.get_user_by_pk(receiver_id)
             else:
                 receiver = None
 
-            chat_permittable = await db_operations.check_chat_is_permitted(chat, sender)
-            if not chat_permittable:
+            if write_behind.is_enabled():
+                msg = await write_behind.get_buffer().save_message(
+                    chat=chat,
+                    sndr=sender,
+                    rcpt=receiver,
+                    msg_type=message_type,
+                    content=message_content,
+                    reply_channel=self.channel_name,
+                )
+            else:
+                msg = await db_operations.save_message_to_db(
+                    chat=chat,
+                    sndr=sender,
+                    rcpt=receiver,
+                    msg_type=message_type,
+                    content=message_content,
+                )
+            if msg is None:
                 return
-
-            msg = await db_operations.save_message_to_db(
-                chat=chat,
-                sndr=sender,
-                rcpt=receiver,
-                msg_type=message_type,
-                content=message_content,
-            )
             event = {
                 "type": self.send_private_chat_message.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.CHAT_SEND_MESSAGE.value,
-                "message": MessageDetailSerializer(msg).data
+                "chat_id": chat_id,
+                "message": msg,
             }
-            await self.channel_layer.group_send(
-                self.room_group_name, event
-            )
+            await self.group_send_logged_event(room_group_name, event)
         elif event_type == utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_USER_TYPING_STATUS.value:
-            event = {
-                "type": self.send_private_chat_message.__name__,
-                "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_USER_TYPING_STATUS.value,
-                "user_id": text_data_json["user_id"],
-                "is_typing": text_data_json["is_typing"]
-            }
-            await self.channel_layer.group_send(
-                self.room_group_name, event
-            )
+            if self.is_broadcast_chat(chat_id):
+                return
+            if text_data_json.get("is_typing"):
+                await self.start_typing(chat_id, room_group_name)
+            else:
+                await self.stop_typing(chat_id)
         elif event_type == utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_SEE_MESSAGE.value:
+            message_id = text_data_json.get("message_id")
+            if not message_id or not isinstance(message_id, int):
+                return
+            # messages of other chats are not found, so nothing unrelated
+            # reaches this chat's group and event log
             msg = await db_operations.mark_message_as_read(
-                mid=text_data_json["message_id"],
-                user_id=self.scope["user"].id
+                mid=message_id,
+                user_id=self.scope["user"].id,
+                chat_id=chat_id,
             )
+            if msg is None:
+                return
             event = {
                 "type": self.send_private_chat_message.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_SEE_MESSAGE.value,
+                "chat_id": chat_id,
                 "message": msg
             }
-            await self.channel_layer.group_send(
-                self.room_group_name, event
+            await self.send_to_chat_or_self(room_group_name, event, logged=True)
+        elif event_type == utils.ReceiveMessageEventTypesEnum.CHAT_READ_MESSAGES.value:
+            message_id = text_data_json.get("message_id")
+            if not message_id or not isinstance(message_id, int):
+                return
+            receipt = await db_operations.mark_chat_as_read(
+                chat_id=chat_id,
+                user_id=self.scope["user"].id,
+                message_id=message_id,
             )
+            if receipt is None:
+                return
+            event = {
+                "type": self.send_private_chat_message.__name__,
+                "EVENT_TYPE": utils.SendMessageEventTypesEnum.CHAT_READ_MESSAGES.value,
+                "chat_id": chat_id,
+                **receipt,
+            }
+            await self.send_to_chat_or_self(room_group_name, event, logged=True)
         elif event_type == utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_EDIT_MESSAGE.value:
+            message_id = text_data_json.get("message_id")
+            message_text = text_data_json.get("message_text")
+            if not message_id or not isinstance(message_id, int) or not isinstance(message_text, str):
+                return
             msg = await db_operations.update_message_by_id(
-                msg_id=text_data_json["message_id"],
+                msg_id=message_id,
                 user_id=self.scope["user"].id,
-                new_content=text_data_json["message_text"]
+                chat_id=chat_id,
+                new_content=message_text,
             )
+            if msg is None:
+                return
             event = {
                 "type": self.send_private_chat_message.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_EDIT_MESSAGE.value,
+                "chat_id": chat_id,
                 "message": msg,
             }
-            await self.channel_layer.group_send(
-                self.room_group_name, event
-            )
+            await self.group_send_logged_event(room_group_name, event)
         elif event_type == utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_MESSAGE_DELETE.value:
             message_id = text_data_json.get("message_id")
             if not message_id or not isinstance(message_id, int):
                 return
-            msg = await db_operations.get_message_by_id(message_id)
+            msg = await db_operations.get_message_by_id(message_id, chat_id)
             if not msg:
                 return
             is_deleted = await db_operations.soft_delete_message(msg=msg, user=self.scope["user"])
@@ -161,12 +406,195 @@ class ChatConsumer(AsyncWebsocketConsumer):
             event = {
                 "type": self.send_private_chat_message.__name__,
                 "EVENT_TYPE": utils.SendMessageEventTypesEnum.PRIVATE_CHAT_MESSAGE_DELETE.value,
-                "msg_id": msg.id
+                "chat_id": chat_id,
+                "msg_id": msg.id,
+                "seq": msg.seq,
             }
-            await self.channel_layer.group_send(self.room_group_name, event)
+            await self.group_send_logged_event(room_group_name, event)
+
+    async def chat_membership_changed(self, event):
+        """
+        Returns whether the event is about this connection's user leaving the chat.
+        """
+        if event["user_id"] != self.scope["user"].id:
+            return False
+        self.permitted_chats.pop(event["chat_id"], None)
+        return not event["is_active"]
 
     async def send_online_offline_event(self, event):
-        await self.send(text_data=json.dumps(event))
+        await self.send(text_data=event["text"])
+
+    async def send_typing_status(self, event):
+        if event["sender_channel"] == self.channel_name:
+            return
+        await self.send(text_data=event["text"])
 
     async def send_private_chat_message(self, event):
-        await self.send(text_data=json.dumps(event))
+        replay_cursor = self.replay_cursors.get(event.get("chat_id"))
+        if replay_cursor is not None and "event_id" in event:
+            if event_log.parse_event_id(event["event_id"]) <= replay_cursor:
+                return
+            del self.replay_cursors[event["chat_id"]]
+        await self.send(text_data=event["text"])
+
+    async def message_persisted(self, event):
+        await self.send(text_data=event["text"])
+
+
+class ChatConsumer(BaseChatConsumer):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.chat_id = None
+        self.room_name = "None"
+        self.room_group_name = "None"
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.reject("anonymous")
+            return
+        try:
+            chat_id = int(self.scope["url_route"]["kwargs"]["chat_id"])
+        except ValueError:
+            await self.reject("invalid_chat")
+            return
+        chat = await self.get_permitted_chat(chat_id)
+        if chat is None:
+            await self.reject("not_permitted")
+            return
+
+        self.chat_id = chat.id
+        self.room_name = utils.get_room_name(chat.id)
+        self.room_group_name = utils.get_room_group_name(chat.id)
+
+        await self.channel_layer.group_add(
+            self.room_group_name, self.channel_name
+        )
+        await self.accept()
+
+        # ws/chat/<id>/?last_event_id=<event_id> resumes after that event
+        last_event_id = parse_qs(self.scope["query_string"].decode()).get("last_event_id")
+        if last_event_id:
+            await self.replay_events(self.chat_id, last_event_id[0])
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol=subprotocol)
+        await self.presence_connect()
+        await self.broadcast_online_status(
+            self.room_group_name, self.chat_id, is_online=True
+        )
+
+    async def disconnect(self, close_code):
+        if self.chat_id is None:
+            return
+        metrics.inc(metrics.DISCONNECTIONS, type(self).__name__)
+        await self.stop_all_typing()
+        await self.channel_layer.group_discard(
+            self.room_group_name, self.channel_name
+        )
+        is_online = await self.presence_disconnect()
+        await self.broadcast_online_status(
+            self.room_group_name, self.chat_id, is_online=is_online
+        )
+
+    async def handle_frame(self, text_data_json):
+        if text_data_json.get("EVENT_TYPE") in CHAT_EVENT_TYPES:
+            await self.handle_chat_event(self.chat_id, self.room_group_name, text_data_json)
+        else:
+            await super().handle_frame(text_data_json)
+
+    async def chat_membership_changed(self, event):
+        if await super().chat_membership_changed(event):
+            # disconnect() leaves the group
+            await self.close()
+
+
+class ChatStreamConsumer(BaseChatConsumer):
+    """
+    One socket per user. The client subscribes to chats with
+    {"EVENT_TYPE": "subscribe_chat", "chat_id": <id>} and every other frame
+    carries the chat_id it belongs to. Outgoing events always include chat_id.
+    A subscribe frame with "last_event_id" also replays what was missed.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # chat_id -> room group name
+        self.subscriptions = {}
+
+    async def connect(self):
+        if self.scope["user"].is_anonymous:
+            await self.reject("anonymous")
+            return
+        await self.accept()
+        await self.presence_connect()
+
+    async def disconnect(self, close_code):
+        if self.scope["user"].is_anonymous:
+            return
+        metrics.inc(metrics.DISCONNECTIONS, type(self).__name__)
+        await self.stop_all_typing()
+        is_online = await self.presence_disconnect()
+        for chat_id, room_group_name in self.subscriptions.items():
+            await self.channel_layer.group_discard(room_group_name, self.channel_name)
+            await self.broadcast_online_status(room_group_name, chat_id, is_online=is_online)
+        self.subscriptions = {}
+
+    async def subscribe(self, chat_id):
+        if chat_id in self.subscriptions:
+            return True
+        if await self.get_permitted_chat(chat_id) is None:
+            return False
+
+        room_group_name = utils.get_room_group_name(chat_id)
+        await self.channel_layer.group_add(room_group_name, self.channel_name)
+        self.subscriptions[chat_id] = room_group_name
+        await self.broadcast_online_status(room_group_name, chat_id, is_online=True)
+        return True
+
+    async def unsubscribe(self, chat_id):
+        if chat_id in self.typing:
+            await self.stop_typing(chat_id)
+        room_group_name = self.subscriptions.pop(chat_id, None)
+        if room_group_name is None:
+            return
+        self.permitted_chats.pop(chat_id, None)
+        await self.channel_layer.group_discard(room_group_name, self.channel_name)
+
+    async def send_unsubscribed(self, chat_id):
+        await self.send(text_data=utils.encode_event({
+            "EVENT_TYPE": utils.SendMessageEventTypesEnum.UNSUBSCRIBE_CHAT.value,
+            "chat_id": chat_id,
+            "is_subscribed": False,
+        }))
+
+    async def handle_frame(self, text_data_json):
+        try:
+            chat_id = int(text_data_json.get("chat_id"))
+        except (TypeError, ValueError):
+            await super().handle_frame(text_data_json)
+            return
+
+        event_type = text_data_json.get("EVENT_TYPE")
+        if event_type == utils.ReceiveMessageEventTypesEnum.SUBSCRIBE_CHAT.value:
+            is_subscribed = await self.subscribe(chat_id)
+            await self.send(text_data=utils.encode_event({
+                "EVENT_TYPE": utils.SendMessageEventTypesEnum.SUBSCRIBE_CHAT.value,
+                "chat_id": chat_id,
+                "is_subscribed": is_subscribed,
+            }))
+            if is_subscribed and text_data_json.get("last_event_id"):
+                await self.replay_events(chat_id, str(text_data_json["last_event_id"]))
+        elif event_type == utils.ReceiveMessageEventTypesEnum.UNSUBSCRIBE_CHAT.value:
+            await self.unsubscribe(chat_id)
+            await self.send_unsubscribed(chat_id)
+        elif chat_id in self.subscriptions and event_type in CHAT_EVENT_TYPES:
+            await self.handle_chat_event(chat_id, self.subscriptions[chat_id], text_data_json)
+        else:
+            # unknown frames, and frames for chats the socket is not subscribed to
+            await super().handle_frame(text_data_json)
+
+    async def chat_membership_changed(self, event):
+        if await super().chat_membership_changed(event) and event["chat_id"] in self.subscriptions:
+            # the client learns it was unsubscribed like after unsubscribe_chat
+            await self.unsubscribe(event["chat_id"])
+            await self.send_unsubscribed(event["chat_id"])
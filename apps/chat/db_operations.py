@@ -1,53 +1,54 @@
-from channels.db import database_sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from channels.db import DatabaseSyncToAsync
 from typing import Awaitable, Optional
+from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser
+from django.db import transaction
 from django.utils import timezone
 
 from apps.accounts.models import (
     User,
 )
-from apps.chat import models
+from apps.chat import caches, models, utils
+from apps.common.cache import MISSING
 from apps.chat.models import Message
-from apps.chat.serializers import MessageDetailSerializer
 
-
-@database_sync_to_async
-def get_chat_by_id(chat_id: int) -> Awaitable[Optional[models.Chat]]:
-    return models.Chat.objects.filter(id=chat_id).first()
-
-
-@database_sync_to_async
-def check_chat_is_permitted(chat: models.Chat, user: User) -> bool:
-    return chat.is_permitted(user)
+# Chat sockets get their own pool instead of the single thread that
+# thread_sensitive database_sync_to_async shares with the whole process.
+# Every worker thread keeps its own connection (CONN_MAX_AGE), so the pool
+# size is the number of Postgres connections a daphne process may use.
+chat_db_executor = ThreadPoolExecutor(
+    max_workers=settings.CHAT_DB_EXECUTOR_WORKERS,
+    thread_name_prefix="chat-db",
+)
 
 
-@database_sync_to_async
-def get_user_by_pk(pk: int) -> Awaitable[Optional[AbstractBaseUser]]:
-    return User.objects.filter(pk=pk).first()
+def chat_database_sync_to_async(func):
+    return DatabaseSyncToAsync(func, thread_sensitive=False, executor=chat_db_executor)
 
 
-@database_sync_to_async
-def user_is_online(user: User) -> bool:
-    return user.is_online
+load_chat = chat_database_sync_to_async(caches.chats.get)
+load_user = chat_database_sync_to_async(caches.users.get)
 
 
-@database_sync_to_async
-def set_user_online(user: User) -> Awaitable[None]:
-    user.is_online = True
-    user.last_seen_at = timezone.now()
-    return user.save()
+async def get_chat_by_id(chat_id: int) -> Optional[models.Chat]:
+    # a hit in this process needs no executor thread
+    chat = caches.chats.get_local(chat_id)
+    if chat is MISSING:
+        chat = await load_chat(chat_id)
+    return chat
 
 
-@database_sync_to_async
-def set_user_offline(user: User) -> Awaitable[None]:
-    user.is_online = False
-    user.last_seen_at = timezone.now()
-    return user.save()
+async def get_user_by_pk(pk: int) -> Optional[AbstractBaseUser]:
+    user = caches.users.get_local(pk)
+    if user is MISSING:
+        user = await load_user(pk)
+    return user
 
 
-@database_sync_to_async
+@chat_database_sync_to_async
 def save_message_to_db(chat: models.Chat, sndr: User, rcpt: Optional[User], msg_type, content) -> Awaitable[
-    models.Message]:
+    dict | None]:
     if msg_type == Message.MessageTypeChoices.TEXT.value:
         msg = Message(
             chat=chat,
@@ -59,82 +60,94 @@ def save_message_to_db(chat: models.Chat, sndr: User, rcpt: Optional[User], msg_
     else:
         # TODO: handle file messages, etc.
         return
-    msg.save()
-    return msg
-
-
-@database_sync_to_async
-def create_text_message(chat: models.Chat, sndr: User, rpt: User, text: str) -> Awaitable[models.Message]:
-    try:
-        msg = Message.objects.create(
-            chat=chat,
-            sender=sndr,
-            recipient=rpt,
-            text=text,
-        )
-    except Exception as e:
-        print(e)
-        raise e
-    return msg
-
-
-@database_sync_to_async
-def create_file_message(chat: models.Chat, sndr: User, rpt: User, file: str) -> Awaitable[models.Message]:
-    try:
-        msg = Message.objects.create(
-            chat=chat,
-            sender=sndr,
-            recipient=rpt,
-            file=file,
-        )
-    except Exception as e:
-        print(e)
-        raise e
-    return msg
-
-
-@database_sync_to_async
-def get_message_by_id(mid: int) -> Message | None:
-    msg: Optional[models.Message] = models.Message.objects.filter(id=mid).first()
+    with transaction.atomic():
+        msg.seq = models.Chat.objects.allocate_seq(chat.id)
+        msg.save()
+        models.Chat.objects.set_last_message(msg)
+        if not chat.is_broadcast:
+            models.ChatMembership.objects.apply_new_message(msg)
+    return utils.MessageDataClass.from_instance(msg).to_dict()
+
+
+@chat_database_sync_to_async
+def get_message_by_id(mid: int, chat_id: int) -> Message | None:
+    msg: Optional[models.Message] = models.Message.objects.filter(id=mid, chat_id=chat_id).first()
     if msg:
         return msg
     return None
 
 
-@database_sync_to_async
-def mark_message_as_read(mid: int, user_id: int) -> Awaitable[models.Message | None]:
-    msg = Message.objects.filter(id=mid, recipient_id=user_id).first()
-    if not msg:
+@chat_database_sync_to_async
+def mark_message_as_read(mid: int, user_id: int, chat_id: int) -> Awaitable[dict | None]:
+    row = Message.objects.filter(id=mid, recipient_id=user_id, chat_id=chat_id).values(
+        *utils.MessageDataClass.VALUES_FIELDS
+    ).first()
+    if not row:
         return None
-    if msg.is_seen:
-        return MessageDetailSerializer(msg).data
+    msg, = utils.MessageDataClass.from_values([row])
+    read_at = timezone.now()
+    models.ChatMembership.objects.advance_read_cursor(
+        chat_id=msg.chat_id, user_id=user_id, message_id=msg.id, read_at=read_at
+    )
     msg.is_seen = True
-    msg.seen_at = timezone.now()
-    msg.save(update_fields=['is_seen', 'seen_at'])
-    return MessageDetailSerializer(msg, context={"user": msg.sender}).data
+    msg.seen_at = msg.seen_at or read_at
+    return msg.to_dict()
 
 
-@database_sync_to_async
-def update_message_by_id(msg_id: int, user_id: int, new_content: str) -> Awaitable[models.Message | None]:
-    msg = Message.objects.filter(id=msg_id, sender_id=user_id).first()
+@chat_database_sync_to_async
+def mark_chat_as_read(chat_id: int, user_id: int, message_id: int) -> Awaitable[dict | None]:
+    read_at = timezone.now()
+    is_advanced = models.ChatMembership.objects.advance_read_cursor(
+        chat_id=chat_id, user_id=user_id, message_id=message_id, read_at=read_at
+    )
+    if not is_advanced:
+        return None
+    return {
+        "user_id": user_id,
+        "last_read_message_id": message_id,
+        "last_read_at": utils.format_datetime(read_at),
+    }
+
+
+@chat_database_sync_to_async
+def update_message_by_id(msg_id: int, user_id: int, chat_id: int, new_content: str) -> Awaitable[dict | None]:
+    msg = Message.objects.filter(
+        id=msg_id, sender_id=user_id, chat_id=chat_id
+    ).select_related("sender", "recipient").first()
     if not msg:
         return None
+    msg.is_seen = utils.is_read_by_others(
+        msg.sender_id, msg.seq, models.ChatMembership.objects.read_cursors(msg.chat_id)
+    )
     if msg.content == new_content:
-        return MessageDetailSerializer(msg, context={"user": msg.sender}).data
+        return utils.MessageDataClass.from_instance(msg).to_dict()
     msg.content = new_content
     msg.is_edited = True
-    msg.save(update_fields=['content', 'is_edited'])
-    return MessageDetailSerializer(msg, context={"user": msg.sender}).data
+    with transaction.atomic():
+        msg.save(update_fields=['content', 'is_edited'])
+        models.Chat.objects.update_last_message_preview(msg)
+    return utils.MessageDataClass.from_instance(msg).to_dict()
 
 
-@database_sync_to_async
+@chat_database_sync_to_async
 def get_unread_count(sender, recipient) -> Awaitable[int]:
     return Message.get_unread_count_for_private_chat(sender, recipient)
 
 
-@database_sync_to_async
+@chat_database_sync_to_async
 def soft_delete_message(msg: Message, user) -> bool:
     if msg.sender_id != user.pk:
         return False
-    msg.soft_delete()
+    with transaction.atomic():
+        # conditional, so a message deleted twice (or by two sockets at once)
+        # is only taken off the unread counts once
+        deleted_at = timezone.now()
+        if not Message.objects.filter(id=msg.id, is_deleted=False).update(is_deleted=True, deleted_at=deleted_at):
+            return False
+        msg.is_deleted, msg.deleted_at = True, deleted_at
+        models.Chat.objects.filter(id=msg.chat_id, last_message_id=msg.id).refresh_last_message()
+        # channel unread counts are recounted on sync, see sync_broadcast_chats
+        models.ChatMembership.objects.exclude(
+            chat__type=models.Chat.ChatTypeChoices.CHANNEL
+        ).decrement_unread_counts(msg)
     return True
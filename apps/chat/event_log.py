@@ -0,0 +1,73 @@
+"""
+Recent outgoing events of every chat, kept in a capped Redis stream so a
+reconnecting socket can be sent what it missed instead of reloading the chat.
+
+Each logged event carries the stream id it got as "event_id". A client
+reconnects with the last event_id it saw and is replayed everything after it,
+or told to resync when the log no longer reaches back that far.
+"""
+import json
+
+from django.conf import settings
+
+from apps.chat import utils
+from apps.common.redis_client import get_async_redis
+
+EVENTS_KEY = "chat:events:{chat_id}"
+EVENT_FIELD = "event"
+
+
+def parse_event_id(event_id):
+    """
+    Stream id "<ms>-<seq>" as a comparable tuple, None if it is not one.
+    """
+    try:
+        ms, seq = str(event_id).split("-")
+        return int(ms), int(seq)
+    except ValueError:
+        return None
+
+
+def with_event_id(event: dict, event_id: str) -> str:
+    return utils.encode_event({**event, "event_id": event_id})
+
+
+async def append(chat_id: int, event: dict) -> str:
+    """
+    Log a client-facing event and return its event_id. The event is stored
+    without its own id and gets it back when replayed.
+    """
+    key = EVENTS_KEY.format(chat_id=chat_id)
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.xadd(
+            key, {EVENT_FIELD: utils.encode_event(event)},
+            maxlen=settings.CHAT_EVENT_LOG_MAXLEN, approximate=True,
+        )
+        pipe.expire(key, settings.CHAT_EVENT_LOG_TTL)
+        event_id, _ = await pipe.execute()
+    return event_id.decode()
+
+
+async def read_since(chat_id: int, last_event_id: str):
+    """
+    Returns [(event_id, text)] of the events logged after last_event_id, or
+    None when events after it may already have been trimmed from the log.
+    """
+    last_event_key = parse_event_id(last_event_id)
+    if last_event_key is None:
+        return None
+
+    key = EVENTS_KEY.format(chat_id=chat_id)
+    async with get_async_redis().pipeline(transaction=True) as pipe:
+        pipe.xrange(key, count=1)
+        pipe.xrange(key, min=f"({last_event_id}")
+        first, entries = await pipe.execute()
+
+    # last_event_id itself was logged, so unless it is still in the log
+    # everything up to the oldest retained entry may be gone
+    if not first or last_event_key < parse_event_id(first[0][0].decode()):
+        return None
+    return [
+        (event_id.decode(), with_event_id(json.loads(fields[EVENT_FIELD.encode()]), event_id.decode()))
+        for event_id, fields in entries
+    ]
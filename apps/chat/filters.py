@@ -0,0 +1,15 @@
+from rest_framework import filters
+
+
+class SearchDocumentFilter(filters.SearchFilter):
+    """
+    ?search= over the queryset's indexed search_document, every term must be
+    contained in it. SearchFilter's icontains lookups compare UPPER(column)
+    and so cannot use a trigram index on the column.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        return queryset.search(terms)
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from apps.chat.models import Chat
+
+
+class Command(BaseCommand):
+    help = "Fill the last message snapshot of existing chats from their messages"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_id = Chat.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+        updated = 0
+        for start in range(0, max_id + 1, batch_size):
+            updated += Chat.objects.filter(
+                id__gte=start, id__lt=start + batch_size
+            ).refresh_last_message()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} chats"))
@@ -0,0 +1,269 @@
+import asyncio
+import contextvars
+import json
+import random
+import statistics
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from unittest import mock
+
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from apps.accounts import presence
+from apps.accounts.models import User
+from apps.chat import consumers, event_log, membership_index, models, utils
+from apps.common.redis_client import get_redis
+
+IN_MEMORY_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+        "CONFIG": {"capacity": 10_000},
+    },
+}
+# seconds to wait for the last deliveries once every message was sent
+DRAIN_TIMEOUT = 30
+
+# EVENT_TYPE of the frame the current consumer code runs for
+current_event = contextvars.ContextVar("current_event", default=None)
+
+
+class QueryCounter:
+    """
+    Counts the queries run on any connection, by the event they ran for.
+    Chat queries run on the chat_db_executor threads, the event reaches them
+    through the context that sync_to_async copies.
+    """
+
+    def __init__(self):
+        self.queries = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        event = current_event.get()
+        if event is not None:
+            self.queries[event] += 1
+        return execute(sql, params, many, context)
+
+    def install(self, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+    def __enter__(self):
+        for connection in connections.all():
+            self.install(connection)
+        connection_created.connect(self.install)
+        return self
+
+    def __exit__(self, *exc_info):
+        connection_created.disconnect(self.install)
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive simulated users through ChatConsumer on core.asgi.application and report "
+        "send-to-deliver latency, throughput, queries per event type and peak memory"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument("--chats", type=int, default=10, help="group chats the users are spread over")
+        parser.add_argument("--messages", type=int, default=20, help="messages per user")
+        parser.add_argument("--interval-ms", type=int, default=50, help="pause between a user's messages")
+        parser.add_argument("--read-every", type=int, default=5, help="send a read receipt every n deliveries")
+        parser.add_argument(
+            "--layer", choices=("memory", "redis"), default="memory",
+            help="in-memory channel layer or the configured CHANNEL_LAYERS",
+        )
+        parser.add_argument(
+            "--i-know-this-writes", action="store_true",
+            help="run against the configured database and Redis even though DEBUG is off",
+        )
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options["i_know_this_writes"]:
+            raise CommandError(
+                "bench_chat_load creates users, chats and messages in the configured database; "
+                "run it with DEBUG on or pass --i-know-this-writes"
+            )
+        # imported here so the ASGI app is only built when the command runs
+        from core.asgi import application
+
+        prefix = "bench_" + uuid.uuid4().hex[:8]
+        users, chats = [], []
+        try:
+            users.extend(
+                User.objects.create_user(username=f"{prefix}_{i}", email=f"{prefix}_{i}@bench.local")
+                for i in range(options["users"])
+            )
+            chats.extend(
+                models.Chat.objects.create(
+                    type=models.Chat.ChatTypeChoices.GROUP, name=f"{prefix}_{i}", owner=users[i]
+                )
+                for i in range(options["chats"])
+            )
+            placement = [(user, chats[i % len(chats)]) for i, user in enumerate(users)]
+            models.ChatMembership.objects.bulk_create(
+                [models.ChatMembership(chat=chat, user=user) for user, chat in placement]
+            )
+            tokens = {user.id: str(AccessToken.for_user(user)) for user in users}
+
+            layers = IN_MEMORY_LAYERS if options["layer"] == "memory" else None
+            with override_settings(**({"CHANNEL_LAYERS": layers} if layers else {})), QueryCounter() as counter:
+                tracemalloc.start()
+                try:
+                    stats = asyncio.run(self.run(application, placement, tokens, options))
+                    peak_memory = tracemalloc.get_traced_memory()[1]
+                finally:
+                    tracemalloc.stop()
+            self.report(stats, counter.queries, peak_memory, options)
+        finally:
+            self.clean_up(users, chats)
+
+    @staticmethod
+    def clean_up(users, chats):
+        """
+        Delete what the run created: the chats with their memberships and
+        messages, the users, and their event logs, member sets and presence.
+        """
+        chat_ids = [chat.id for chat in chats]
+        user_ids = [user.id for user in users]
+        models.Chat.objects.filter(id__in=chat_ids).delete()
+        User.objects.filter(id__in=user_ids).delete()
+        pipe = get_redis().pipeline(transaction=False)
+        for chat_id in chat_ids:
+            pipe.delete(event_log.EVENTS_KEY.format(chat_id=chat_id), *membership_index.get_keys(chat_id))
+        for user_id in user_ids:
+            pipe.delete(presence.CONNECTIONS_KEY.format(user_id=user_id))
+        if user_ids:
+            pipe.zrem(presence.ONLINE_KEY, *user_ids)
+            pipe.hdel(presence.LAST_SEEN_KEY, *user_ids)
+            pipe.srem(presence.DIRTY_KEY, *user_ids)
+        pipe.execute()
+
+    async def run(self, application, placement, tokens, options):
+        members = Counter(chat.id for _, chat in placement)
+        expected = sum(options["messages"] * (members[chat.id] - 1) for _, chat in placement)
+        stats = {"latencies": [], "events": Counter(), "sent": 0, "expected": expected}
+        delivered_all = asyncio.Event()
+        if not expected:
+            delivered_all.set()
+
+        async def receiver(communicator, user):
+            deliveries = 0
+            while True:
+                message = await communicator.output_queue.get()
+                if message["type"] != "websocket.send":
+                    continue
+                event = json.loads(message["text"])
+                if event.get("EVENT_TYPE") != utils.SendMessageEventTypesEnum.CHAT_SEND_MESSAGE.value:
+                    continue
+                if event["message"]["sender"]["id"] == user.id:
+                    continue
+                stats["latencies"].append(time.perf_counter() - float(event["message"]["content"]))
+                if len(stats["latencies"]) >= expected:
+                    delivered_all.set()
+                deliveries += 1
+                if options["read_every"] and deliveries % options["read_every"] == 0:
+                    await self.send_frame(communicator, stats, {
+                        "EVENT_TYPE": utils.ReceiveMessageEventTypesEnum.CHAT_READ_MESSAGES.value,
+                        "message_id": event["message"]["id"],
+                    })
+
+        async def sender(communicator):
+            await asyncio.sleep(random.random() * options["interval_ms"] / 1000)
+            for _ in range(options["messages"]):
+                await self.send_frame(communicator, stats, {
+                    "EVENT_TYPE": utils.ReceiveMessageEventTypesEnum.PRIVATE_CHAT_USER_TYPING_STATUS.value,
+                    "is_typing": True,
+                })
+                await self.send_frame(communicator, stats, {
+                    "EVENT_TYPE": utils.ReceiveMessageEventTypesEnum.CHAT_SEND_MESSAGE.value,
+                    "message_type": models.Message.MessageTypeChoices.TEXT.value,
+                    "message_text": repr(time.perf_counter()),
+                })
+                stats["sent"] += 1
+                await asyncio.sleep(options["interval_ms"] / 1000)
+
+        handle_chat_event = consumers.BaseChatConsumer.handle_chat_event
+
+        async def counted_handle_chat_event(consumer, chat_id, room_group_name, text_data_json):
+            token = current_event.set(text_data_json.get("EVENT_TYPE"))
+            try:
+                return await handle_chat_event(consumer, chat_id, room_group_name, text_data_json)
+            finally:
+                current_event.reset(token)
+
+        async def counted_application(scope, receive, send):
+            # queries outside of a frame's handler (token user, chat permission,
+            # disconnect) count as "connect"
+            current_event.set("connect")
+            return await application(scope, receive, send)
+
+        with mock.patch.object(consumers.BaseChatConsumer, "handle_chat_event", counted_handle_chat_event):
+            communicators = [
+                (WebsocketCommunicator(
+                    counted_application,
+                    f"/ws/chat/{chat.id}/?token={tokens[user.id]}",
+                    headers=[(b"origin", b"http://localhost")],
+                ), user)
+                for user, chat in placement
+            ]
+            for communicator, _ in communicators:
+                connected, _ = await communicator.connect()
+                if not connected:
+                    raise RuntimeError("websocket connection was refused")
+            stats["events"]["connect"] = len(communicators)
+            tracemalloc.reset_peak()
+
+            receivers = [asyncio.create_task(receiver(communicator, user)) for communicator, user in communicators]
+            started = time.perf_counter()
+            await asyncio.gather(*[sender(communicator) for communicator, _ in communicators])
+            sent = time.perf_counter() - started
+            try:
+                await asyncio.wait_for(delivered_all.wait(), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            stats["elapsed"] = time.perf_counter() - started
+            stats["send_elapsed"] = sent
+
+            for task in receivers:
+                task.cancel()
+            for communicator, _ in communicators:
+                await communicator.disconnect()
+        return stats
+
+    @staticmethod
+    async def send_frame(communicator, stats, frame):
+        stats["events"][frame["EVENT_TYPE"]] += 1
+        await communicator.send_to(text_data=json.dumps(frame))
+
+    def report(self, stats, queries, peak_memory, options):
+        latencies = stats["latencies"]
+        self.stdout.write(
+            f"{options['users']} users in {options['chats']} chats, {options['messages']} messages each, "
+            f"{options['layer']} channel layer"
+        )
+        self.stdout.write(
+            f"sent {stats['sent']} messages in {stats['send_elapsed']:.2f} s "
+            f"({stats['sent'] / stats['send_elapsed']:.1f} msg/s), "
+            f"delivered {len(latencies)}/{stats['expected']} in {stats['elapsed']:.2f} s "
+            f"({len(latencies) / stats['elapsed']:.1f} deliveries/s)"
+        )
+        if len(latencies) >= 2:
+            quantiles = statistics.quantiles(latencies, n=100)
+            self.stdout.write(
+                "send->deliver latency: "
+                f"p50 {quantiles[49] * 1000:.2f} ms  p95 {quantiles[94] * 1000:.2f} ms  "
+                f"p99 {quantiles[98] * 1000:.2f} ms"
+            )
+        self.stdout.write("queries per event:")
+        for event, count in sorted(stats["events"].items()):
+            self.stdout.write(f"  {event:>32}: {queries[event] / count:6.2f}  ({count} events)")
+        self.stdout.write(f"peak traced memory: {peak_memory / 2 ** 20:.1f} MiB")
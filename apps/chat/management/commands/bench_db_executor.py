@@ -0,0 +1,87 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.accounts.models import User
+from apps.chat import db_operations, models
+
+
+def slow_query(seconds):
+    if connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_sleep(%s)", [seconds])
+    else:
+        time.sleep(seconds)
+
+
+class Command(BaseCommand):
+    help = "Measure concurrent message sends on the shared thread-sensitive executor vs the chat DB executor"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--senders", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=20, help="messages per sender")
+        parser.add_argument(
+            "--slow-ms", type=int, default=0,
+            help="run one slow query of this length alongside the sends",
+        )
+
+    def handle(self, *args, **options):
+        prefix = "bench_" + uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(username=f"{prefix}_{i}", email=f"{prefix}_{i}@bench.local")
+            for i in range(options["senders"])
+        ]
+        chat = models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name=prefix, owner=users[0])
+        models.ChatMembership.objects.bulk_create(
+            [models.ChatMembership(chat=chat, user=user) for user in users]
+        )
+        try:
+            self.stdout.write(
+                f"{options['senders']} senders x {options['messages']} messages, "
+                f"chat executor workers: {db_operations.chat_db_executor._max_workers}"
+            )
+            for label, wrap in (
+                ("thread_sensitive", database_sync_to_async),
+                ("chat executor", db_operations.chat_database_sync_to_async),
+            ):
+                elapsed, latencies = asyncio.run(
+                    self.run(wrap, chat, users, options["messages"], options["slow_ms"] / 1000)
+                )
+                quantiles = statistics.quantiles(latencies, n=100)
+                self.stdout.write(
+                    f"{label:>16}: {len(latencies) / elapsed:8.1f} msg/s  "
+                    f"p50 {quantiles[49] * 1000:7.2f} ms  p99 {quantiles[98] * 1000:7.2f} ms"
+                )
+        finally:
+            chat.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    @staticmethod
+    async def run(wrap, chat, users, messages, slow_seconds):
+        save_message_to_db = wrap(db_operations.save_message_to_db.func)
+        latencies = []
+
+        async def sender(user):
+            for _ in range(messages):
+                started = time.perf_counter()
+                await save_message_to_db(
+                    chat=chat,
+                    sndr=user,
+                    rcpt=None,
+                    msg_type=models.Message.MessageTypeChoices.TEXT.value,
+                    content="bench",
+                )
+                latencies.append(time.perf_counter() - started)
+
+        tasks = [sender(user) for user in users]
+        if slow_seconds:
+            tasks.append(wrap(slow_query)(slow_seconds))
+
+        started = time.perf_counter()
+        await asyncio.gather(*tasks)
+        return time.perf_counter() - started, latencies
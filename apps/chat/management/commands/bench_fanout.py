@@ -0,0 +1,83 @@
+import json
+import time
+
+from channels_redis.core import RedisChannelLayer
+from django.core.management.base import BaseCommand
+
+from apps.chat import utils
+
+
+def sample_event():
+    user = {
+        "id": 1,
+        "username": "sender_user",
+        "avatar": "/media/accounts/avatars/2024/01/avatar.png",
+        "first_name": "Sender",
+        "last_name": "User",
+        "last_seen_at": "2024-01-01 10:00:00",
+    }
+    return {
+        "type": "send_private_chat_message",
+        "EVENT_TYPE": utils.SendMessageEventTypesEnum.CHAT_SEND_MESSAGE.value,
+        "chat_id": 1,
+        "message": {
+            "id": 1000,
+            "chat": 1,
+            "type": "TEXT",
+            "sender": user,
+            "recipient": None,
+            "content": "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+            "is_seen": False,
+            "seen_at": None,
+            "is_edited": False,
+            "is_reacted": False,
+            "created_at": "2024-01-01 10:00:00",
+            "is_own_message": False,
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = "Compare CPU per delivered message: encoding per recipient vs once per group_send"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[2, 100, 1000])
+        parser.add_argument("--rounds", type=int, default=200)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            "codec: {}".format("orjson" if utils.orjson is not None else "json (stdlib)")
+        )
+        self.stdout.write(f"{'members':>8} {'per recipient':>16} {'per fan-out':>14} {'speedup':>8}")
+        for size in options["sizes"]:
+            per_recipient = self.run(size, options["rounds"], pre_encoded=False)
+            per_fanout = self.run(size, options["rounds"], pre_encoded=True)
+            self.stdout.write(
+                f"{size:>8} {per_recipient * 1e6:>13.2f} us {per_fanout * 1e6:>11.2f} us "
+                f"{per_recipient / per_fanout:>7.2f}x"
+            )
+
+    @staticmethod
+    def run(size, rounds, pre_encoded):
+        """
+        Returns CPU seconds per delivered message. Models the channels_redis path:
+        the message is msgpack-serialized once at group_send, every receiving
+        consumer deserializes it and builds the websocket frame.
+        """
+        layer = RedisChannelLayer()
+
+        started = time.process_time()
+        for _ in range(rounds):
+            event = sample_event()
+            if pre_encoded:
+                payload = layer.serialize({"type": event["type"], "text": utils.encode_event(event)})
+            else:
+                payload = layer.serialize(event)
+            for _ in range(size):
+                message = layer.deserialize(payload)
+                if pre_encoded:
+                    text_data = message["text"]
+                else:
+                    text_data = json.dumps(message)
+                assert text_data
+        return (time.process_time() - started) / (size * rounds)
@@ -0,0 +1,174 @@
+import asyncio
+import multiprocessing
+import statistics
+import time
+import uuid
+
+import redis
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import import_string
+
+BACKENDS = {
+    "core": "channels_redis.core.RedisChannelLayer",
+    "pubsub": "channels_redis.pubsub.RedisPubSubChannelLayer",
+}
+# seconds a socket waits for the next message before counting the rest as lost
+RECEIVE_TIMEOUT = 10
+
+
+def make_layer(backend):
+    return import_string(BACKENDS[backend])(**settings.CHANNEL_LAYERS["default"].get("CONFIG", {}))
+
+
+async def close_layer(layer):
+    # not flush(), which on the core layer deletes every key of the prefix
+    if hasattr(layer, "close_pools"):
+        await layer.close_pools()
+    else:
+        await layer.flush()
+
+
+def member_process(backend, group, members, messages, ready, results, done):
+    """
+    One daphne process: `members` sockets in the group, each waiting for
+    every message. Puts the number of messages received and
+    {seq: seconds until the last local socket got it}.
+    """
+    import django
+    django.setup()
+
+    async def run():
+        layer = make_layer(backend)
+        channels = [await layer.new_channel() for _ in range(members)]
+        for channel in channels:
+            await layer.group_add(group, channel)
+        # group_add does not wait for the subscription to be confirmed, once a
+        # channel subscribed after them gets a message Redis has them all
+        probe = await layer.new_channel()
+        while True:
+            await layer.send(probe, {"type": "bench.probe"})
+            try:
+                await asyncio.wait_for(layer.receive(probe), 0.5)
+                break
+            except asyncio.TimeoutError:
+                pass
+        ready.release()
+
+        delivered = {}
+        received = 0
+
+        async def receive(channel):
+            nonlocal received
+            for _ in range(messages):
+                try:
+                    message = await asyncio.wait_for(layer.receive(channel), RECEIVE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    return
+                received += 1
+                latency = time.time() - message["sent_at"]
+                delivered[message["seq"]] = max(delivered.get(message["seq"], 0.0), latency)
+
+        await asyncio.gather(*[receive(channel) for channel in channels])
+        results.put((received, delivered))
+        # leave the group only after the commands were counted
+        await asyncio.get_running_loop().run_in_executor(None, done.wait)
+        for channel in channels:
+            await layer.group_discard(group, channel)
+        await close_layer(layer)
+
+    asyncio.run(run())
+
+
+def redis_calls():
+    """
+    Total commands the Redis server has processed, None if it cannot tell.
+    """
+    hosts = settings.CHANNEL_LAYERS["default"].get("CONFIG", {}).get("hosts", [])
+    total = 0
+    for host in hosts:
+        client = redis.Redis.from_url(host if isinstance(host, str) else host["address"])
+        try:
+            stats = client.info("commandstats")
+        except redis.ResponseError:
+            return None
+        finally:
+            client.close()
+        total += sum(stat["calls"] for stat in stats.values())
+    return total
+
+
+class Command(BaseCommand):
+    help = "Measure Redis commands and fan-out latency of group_send for the core and pub/sub channel layers"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--members", type=int, default=2000, help="sockets in the group")
+        parser.add_argument("--processes", type=int, default=4, help="processes the sockets are spread over")
+        parser.add_argument("--messages", type=int, default=50)
+        parser.add_argument("--interval-ms", type=int, default=20, help="pause between group_sends")
+        parser.add_argument("--backend", choices=[*BACKENDS, "both"], default="both")
+
+    def handle(self, *args, **options):
+        backends = list(BACKENDS) if options["backend"] == "both" else [options["backend"]]
+        self.stdout.write(
+            f"{options['members']} members over {options['processes']} processes, "
+            f"{options['messages']} group_sends"
+        )
+        for backend in backends:
+            calls, received, latencies = self.run(
+                backend, options["members"], options["processes"], options["messages"], options["interval_ms"]
+            )
+            quantiles = statistics.quantiles(latencies, n=100)
+            per_send = f"{calls / options['messages']:8.1f}" if calls is not None else "     n/a"
+            self.stdout.write(
+                f"{backend:>7}: {per_send} redis commands/group_send  "
+                f"fan-out p50 {quantiles[49] * 1000:7.2f} ms  p99 {quantiles[98] * 1000:7.2f} ms  "
+                f"delivered {received}/{options['members'] * options['messages']}"
+            )
+
+    @staticmethod
+    def run(backend, members, processes, messages, interval_ms):
+        """
+        Returns the Redis commands processed while the messages were sent and
+        delivered, the number of deliveries and per message the seconds until
+        every member that got it had it.
+        """
+        context = multiprocessing.get_context("spawn")
+        group = f"bench_{uuid.uuid4().hex[:8]}"
+        ready = context.Semaphore(0)
+        results = context.Queue()
+        done = context.Event()
+        workers = [
+            context.Process(
+                target=member_process,
+                args=(backend, group, members // processes + (i < members % processes), messages, ready, results, done),
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.acquire()
+
+        async def send():
+            layer = make_layer(backend)
+            for seq in range(messages):
+                await layer.group_send(group, {"type": "bench.message", "seq": seq, "sent_at": time.time()})
+                await asyncio.sleep(interval_ms / 1000)
+            await close_layer(layer)
+
+        calls_before = redis_calls()
+        asyncio.run(send())
+        received, delivered = zip(*[results.get() for _ in workers])
+        calls_after = redis_calls()
+        done.set()
+        for worker in workers:
+            worker.join()
+
+        latencies = [
+            max(process[seq] for process in delivered if seq in process)
+            for seq in range(messages)
+            if any(seq in process for process in delivered)
+        ]
+        calls = calls_after - calls_before if calls_before is not None else None
+        return calls, sum(received), latencies
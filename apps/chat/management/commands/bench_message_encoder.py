@@ -0,0 +1,74 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from apps.accounts.models import User
+from apps.chat import models, serializers, utils
+
+
+def sample_messages(count):
+    now = timezone.now()
+    sender = User(
+        id=1,
+        username="sender_user",
+        avatar="accounts/avatars/2024/01/avatar.png",
+        first_name="Sender",
+        last_name="User",
+        last_seen_at=now,
+    )
+    recipient = User(id=2, username="recipient_user", first_name="Recipient", last_name="User")
+    return [
+        models.Message(
+            id=i,
+            chat_id=1,
+            type=models.Message.MessageTypeChoices.TEXT.value,
+            sender=sender,
+            recipient=recipient,
+            content="Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 4,
+            is_seen=bool(i % 2),
+            seen_at=now if i % 2 else None,
+            created_at=now,
+        )
+        for i in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare CPU per message: MessageDetailSerializer vs utils.MessageDataClass"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1000)
+        parser.add_argument("--rounds", type=int, default=20)
+
+    def handle(self, *args, **options):
+        messages = sample_messages(options["messages"])
+        if self.serializer(messages[0]) != self.encoder(messages[0]):
+            self.stderr.write("encoder output differs from MessageDetailSerializer")
+            return
+
+        serializer = self.run(self.serializer, messages, options["rounds"])
+        encoder = self.run(self.encoder, messages, options["rounds"])
+        self.stdout.write(f"{'serializer':>12}: {serializer * 1e6:8.2f} us/message")
+        self.stdout.write(f"{'encoder':>12}: {encoder * 1e6:8.2f} us/message")
+        self.stdout.write(f"{'speedup':>12}: {serializer / encoder:8.2f}x")
+
+    @staticmethod
+    def serializer(message):
+        return utils.encode_event(serializers.MessageDetailSerializer(message).data)
+
+    @staticmethod
+    def encoder(message):
+        return utils.encode_event(utils.MessageDataClass.from_instance(message).to_dict())
+
+    @staticmethod
+    def run(encode, messages, rounds):
+        """
+        Returns CPU seconds per message, including the JSON encoding the
+        consumer does before group_send.
+        """
+        started = time.process_time()
+        for _ in range(rounds):
+            for message in messages:
+                encode(message)
+        return (time.process_time() - started) / (len(messages) * rounds)
@@ -0,0 +1,85 @@
+import asyncio
+import statistics
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from apps.accounts.models import User
+from apps.chat import db_operations, models, write_behind
+
+
+class Command(BaseCommand):
+    help = "Measure messages/sec of one process with synchronous inserts vs write-behind batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--senders", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=20, help="messages per sender")
+
+    def handle(self, *args, **options):
+        prefix = "bench_" + uuid.uuid4().hex[:8]
+        users = [
+            User.objects.create_user(username=f"{prefix}_{i}", email=f"{prefix}_{i}@bench.local")
+            for i in range(options["senders"])
+        ]
+        chat = models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name=prefix, owner=users[0])
+        models.ChatMembership.objects.bulk_create(
+            [models.ChatMembership(chat=chat, user=user) for user in users]
+        )
+        modes = [("sync insert", self.save_sync)]
+        if connection.vendor == "postgresql":
+            modes.append(("write-behind", self.save_write_behind))
+        else:
+            self.stdout.write("write-behind needs PostgreSQL, measuring synchronous inserts only")
+        try:
+            self.stdout.write(f"{options['senders']} senders x {options['messages']} messages")
+            for label, save in modes:
+                accepted, durable, latencies = asyncio.run(self.run(save, chat, users, options["messages"]))
+                quantiles = statistics.quantiles(latencies, n=100)
+                self.stdout.write(
+                    f"{label:>13}: {len(latencies) / accepted:8.1f} msg/s broadcast  "
+                    f"{len(latencies) / durable:8.1f} msg/s stored  "
+                    f"p50 {quantiles[49] * 1000:7.2f} ms  p99 {quantiles[98] * 1000:7.2f} ms"
+                )
+            stored = models.Message.objects.filter(chat=chat).count()
+            self.stdout.write(f"messages stored: {stored}")
+        finally:
+            chat.delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+    @staticmethod
+    async def save_sync(**kwargs):
+        return await db_operations.save_message_to_db(**kwargs)
+
+    @staticmethod
+    async def save_write_behind(**kwargs):
+        return await write_behind.get_buffer().save_message(**kwargs)
+
+    @staticmethod
+    async def run(save, chat, users, messages):
+        """
+        Returns the seconds until every message could be broadcast, the
+        seconds until every message was stored and the per-message latencies
+        seen by the sender.
+        """
+        latencies = []
+
+        async def sender(user):
+            for _ in range(messages):
+                started = time.perf_counter()
+                await save(
+                    chat=chat,
+                    sndr=user,
+                    rcpt=None,
+                    msg_type=models.Message.MessageTypeChoices.TEXT.value,
+                    content="bench",
+                )
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*[sender(user) for user in users])
+        accepted = time.perf_counter() - started
+        if save is Command.save_write_behind:
+            await write_behind.get_buffer().flush()
+        return accepted, time.perf_counter() - started, latencies
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+
+from apps.chat.models import ChatMembership
+
+
+class Command(BaseCommand):
+    help = "Recompute ChatMembership.unread_count from the read cursors"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        max_id = ChatMembership.objects.aggregate(max_id=Max("id"))["max_id"] or 0
+        updated = 0
+        for start in range(0, max_id + 1, batch_size):
+            updated += ChatMembership.objects.filter(
+                id__gte=start, id__lt=start + batch_size
+            ).recompute_unread_counts()
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} chat memberships"))
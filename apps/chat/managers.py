@@ -1,47 +1,219 @@
-from django.db import models
+from collections import Counter
+
+from django.db import connections, models
+from django.db.models.functions import Coalesce, Greatest, Substr
 from django.contrib.auth import get_user_model
 
 UserModel = get_user_model()
 
 
-class ChatMembershipQuerySet(models.QuerySet):
-    def annotate_last_message(self, *, outer_ref_name):
-        from apps.chat.models import Message as MessageModel
+LAST_MESSAGE_PREVIEW_LENGTH = 255
 
-        base_subquery = MessageModel.objects.filter(chat=models.OuterRef(outer_ref_name)).order_by('-created_at')
-        created_subquery = base_subquery.values('created_at')[:1]
-        content_subquery = base_subquery.values('content')[:1]
-        sender_subquery = base_subquery.values('sender_id')[:1]
-        is_seen_subquery = base_subquery.values('is_seen')[:1]
 
-        qs = self.annotate(
-            last_message_created_at=models.Subquery(
-                created_subquery, output_field=models.DateTimeField()
+class ChatQuerySet(models.QuerySet):
+    def allocate_seq(self, chat_id, count=1) -> int:
+        """
+        Reserve the next count seqs of the chat and return the last of them.
+        The chat row stays locked until the transaction ends, so messages of
+        a chat are committed in seq order. Call inside the message's
+        transaction.
+        """
+        connection = connections[self.db]
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {table} SET last_seq = last_seq + %s WHERE id = %s RETURNING last_seq",
+                [count, chat_id],
+            )
+            return cursor.fetchone()[0]
+
+    def set_last_message(self, message):
+        """
+        Point the chat's snapshot at a newly created message unless a newer
+        one is already there. Call inside the message's transaction.
+        """
+        return self.filter(id=message.chat_id, last_seq=message.seq).update(
+            last_message_id=message.id,
+            last_message_at=message.created_at,
+            last_message_preview=message.content[:LAST_MESSAGE_PREVIEW_LENGTH],
+            last_message_sender_id=message.sender_id,
+        )
+
+    def update_last_message_preview(self, message):
+        return self.filter(id=message.chat_id, last_message_id=message.id).update(
+            last_message_preview=message.content[:LAST_MESSAGE_PREVIEW_LENGTH],
+        )
+
+    def refresh_last_message(self):
+        """
+        Recompute the snapshot from the newest active message, e.g. after the
+        last message was deleted, or to backfill existing chats.
+        """
+        from apps.chat.models import Message as MessageModel
+
+        latest = MessageModel.objects.active().filter(
+            chat_id=models.OuterRef("pk")
+        ).order_by("-seq")
+        return self.update(
+            last_message_id=models.Subquery(latest.values("id")[:1]),
+            last_message_at=models.Subquery(latest.values("created_at")[:1]),
+            last_message_preview=Coalesce(
+                models.Subquery(
+                    latest.annotate(
+                        preview=Substr("content", 1, LAST_MESSAGE_PREVIEW_LENGTH)
+                    ).values("preview")[:1]
+                ),
+                models.Value(""),
             ),
-            last_message_content=models.Subquery(
-                content_subquery, output_field=models.TextField()
+            last_message_sender_id=models.Subquery(latest.values("sender_id")[:1]),
+        )
+
+
+class ChatMembershipQuerySet(models.QuerySet):
+    def search(self, terms):
+        """
+        Memberships whose search_document contains every term.
+        """
+        queryset = self
+        for term in terms:
+            queryset = queryset.filter(search_document__contains=term.lower())
+        return queryset
+
+    def refresh_search_documents(self, batch_size=500):
+        memberships = list(self.select_related("chat__user1", "chat__user2"))
+        for membership in memberships:
+            membership.search_document = membership.chat.get_search_document(membership.user_id)
+        return self.model.objects.bulk_update(memberships, ["search_document"], batch_size=batch_size)
+
+    def annotate_last_message(self):
+        # the last message is seen once any other member's read cursor reached it,
+        # cursors seeded at join time mark nothing as read
+        is_seen_subquery = self.model.objects.filter(
+            chat_id=models.OuterRef('chat_id'),
+            last_read_message__isnull=False,
+            last_read_seq__gte=models.OuterRef('chat__last_message__seq'),
+        ).exclude(user_id=models.OuterRef('chat__last_message_sender_id'))
+
+        return self.annotate(
+            last_message_id=models.F('chat__last_message_id'),
+            last_message_created_at=models.F('chat__last_message_at'),
+            last_message_content=models.F('chat__last_message_preview'),
+            last_message_sender_id=models.F('chat__last_message_sender_id'),
+            last_message_is_seen=models.Exists(is_seen_subquery),
+        )
+
+    def apply_new_message(self, message):
+        """
+        Move the chat up in every member's list and count the message as unread
+        for everyone except the sender, in one UPDATE.
+        Call inside the message's transaction.
+        """
+        return self.apply_new_messages([message])
+
+    def apply_new_messages(self, messages):
+        """
+        apply_new_message for several new messages of one chat at once.
+        """
+        sent_counts = Counter(message.sender_id for message in messages)
+        return self.filter(chat_id=messages[0].chat_id, is_deleted=False).update(
+            last_message_at=Greatest(
+                models.F('last_message_at'),
+                models.Value(max(message.created_at for message in messages)),
             ),
-            last_message_sender_id=models.Subquery(
-                sender_subquery, output_field=models.IntegerField()
+            unread_count=models.Case(
+                *[
+                    models.When(user_id=user_id, then=models.F('unread_count') + (len(messages) - sent))
+                    for user_id, sent in sent_counts.items()
+                    if user_id is not None
+                ],
+                default=models.F('unread_count') + len(messages),
             ),
-            last_message_is_seen=models.Subquery(
-                is_seen_subquery, output_field=models.BooleanField()
+        )
+
+    def sync_broadcast_chats(self):
+        """
+        Posts to a channel do not touch its memberships. Catch the channel
+        memberships up with the posts made since their last sync: move the
+        channel up the member's list and count the posts after the member's
+        read cursor as unread (deleted posts included). Call before reading
+        a user's chat list.
+        """
+        from apps.chat.models import Chat as ChatModel
+
+        chat = ChatModel.objects.filter(pk=models.OuterRef('chat_id'))
+        return self.filter(
+            chat__type=ChatModel.ChatTypeChoices.CHANNEL,
+            chat__last_message_at__gt=models.F('last_message_at'),
+            is_deleted=False,
+        ).update(
+            last_message_at=models.Subquery(chat.values('last_message_at')[:1]),
+            unread_count=models.Case(
+                models.When(user_id=models.Subquery(chat.values('owner_id')[:1]), then=models.Value(0)),
+                default=Greatest(
+                    models.Subquery(chat.values('last_seq')[:1]) - models.F('last_read_seq'),
+                    models.Value(0),
+                ),
             ),
         )
-        return qs
 
-    def annotate_unseen_messages_count(self, user):
-        return self.annotate(
-            unseen_messages_count=models.Count(
-                models.Case(
-                    models.When(
-                        models.Q(
-                            chat__messages__is_seen=False,
-                            chat__messages__recipient=user,
-                        ),
-                        then=1,
-                    )
-                )
+    def decrement_unread_counts(self, message):
+        """
+        Take a deleted message off the counters of the members that had not read it yet.
+        """
+        return self.filter(
+            chat_id=message.chat_id,
+            last_read_seq__lt=message.seq,
+            is_deleted=False,
+            unread_count__gt=0,
+        ).exclude(user_id=message.sender_id).update(unread_count=models.F('unread_count') - 1)
+
+    def recompute_unread_counts(self):
+        """
+        Recount unread messages from the read cursors, for reconciliation.
+        """
+        from apps.chat.models import Message as MessageModel
+
+        unread = MessageModel.objects.active().filter(
+            chat_id=models.OuterRef('chat_id'),
+            seq__gt=models.OuterRef('last_read_seq'),
+        ).exclude(sender_id=models.OuterRef('user_id')).order_by().values('chat_id').annotate(
+            count=models.Count('id')
+        ).values('count')
+        return self.update(unread_count=Coalesce(models.Subquery(unread), 0))
+
+    def read_cursors(self, chat_id):
+        """
+        The two most advanced read cursors of a chat as [(user_id, last_read_seq)].
+        Enough to tell whether a member other than the sender has read a message.
+        """
+        return list(
+            self.filter(chat_id=chat_id, is_deleted=False, last_read_message__isnull=False)
+            .order_by('-last_read_seq')
+            .values_list('user_id', 'last_read_seq')[:2]
+        )
+
+    def advance_read_cursor(self, *, chat_id, user_id, message_id, read_at) -> bool:
+        """
+        Move the member's read cursor forward to message_id in one conditional
+        UPDATE. Returns False when the cursor already was at or past it.
+        Cursors are compared by seq: message ids are only ordered within the
+        process that reserved them when messages are written behind.
+        """
+        from apps.chat.models import Message as MessageModel
+
+        seq = MessageModel.objects.filter(id=message_id, chat_id=chat_id).values('seq')[:1]
+        unread = MessageModel.objects.active().filter(
+            chat_id=chat_id, seq__gt=models.Subquery(seq)
+        ).exclude(sender_id=user_id).order_by().values('chat_id').annotate(
+            count=models.Count('id')
+        ).values('count')
+        return bool(
+            self.filter(chat_id=chat_id, user_id=user_id, last_read_seq__lt=models.Subquery(seq))
+            .update(
+                last_read_message_id=message_id,
+                last_read_at=read_at,
+                last_read_seq=models.Subquery(seq),
+                unread_count=Coalesce(models.Subquery(unread), 0),
             )
         )
 
@@ -0,0 +1,149 @@
+"""
+Member ids of every chat kept in Redis sets, so the permission checks of the
+REST views and the chat sockets do not query chat_membership.
+
+A chat's set is built from the database on its first check and from then on
+written through by signal_handlers when a membership is created, soft-deleted
+or restored. Every set holds SENTINEL, so a chat without members is told apart
+from one that is not indexed. Sets expire CHAT_MEMBERSHIP_INDEX_TTL seconds
+after they were built, which bounds how long writes that bypass the signals
+(bulk_create, queryset.update) go unnoticed.
+
+Every write-through also bumps the chat's version. A rebuild reads the version
+before it loads the members and only stores them while the version is still
+the same, so a reader that raced a membership change cannot put back the
+member list it loaded before the change.
+"""
+import logging
+
+import redis
+from django.conf import settings
+
+from apps.common.redis_client import get_redis, get_async_redis
+
+logger = logging.getLogger(__name__)
+
+MEMBERS_KEY = "chat:members:{chat_id}"
+VERSION_KEY = "chat:members:{chat_id}:version"
+# never a user id
+SENTINEL = "-"
+# SADD arguments per call, Lua's unpack() has a limit
+BUILD_CHUNK_SIZE = 1000
+
+# write-through only touches sets that exist, a missing one is built in full
+# on its next check
+WRITE_THROUGH_SCRIPT = """
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return redis.call(ARGV[1], KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# ARGV: the version the members were loaded at, the ttl, then the members
+BUILD_SCRIPT = """
+if (redis.call('GET', KEYS[2]) or '0') ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1])
+for i = 3, #ARGV, %d do
+    redis.call('SADD', KEYS[1], unpack(ARGV, i, math.min(i + %d, #ARGV)))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+""" % (BUILD_CHUNK_SIZE, BUILD_CHUNK_SIZE - 1)
+
+
+def load_members(chat_id: int) -> list:
+    from apps.chat.models import ChatMembership
+
+    return list(
+        ChatMembership.objects.filter(chat_id=chat_id, is_deleted=False).values_list("user_id", flat=True)
+    )
+
+
+def get_keys(chat_id: int) -> list:
+    return [MEMBERS_KEY.format(chat_id=chat_id), VERSION_KEY.format(chat_id=chat_id)]
+
+
+def get_build_args(version, member_ids) -> list:
+    return [int(version or 0), settings.CHAT_MEMBERSHIP_INDEX_TTL, SENTINEL, *member_ids]
+
+
+def is_member(chat_id: int, user_id: int) -> bool:
+    members_key, version_key = keys = get_keys(chat_id)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.smismember(members_key, [SENTINEL, user_id])
+        pipe.get(version_key)
+        (is_indexed, is_member_), version = pipe.execute()
+        if is_indexed:
+            return bool(is_member_)
+        member_ids = load_members(chat_id)
+        get_redis().eval(BUILD_SCRIPT, 2, *keys, *get_build_args(version, member_ids))
+    except redis.RedisError:
+        logger.warning("membership index unavailable, checking chat %s in the database", chat_id, exc_info=True)
+        member_ids = load_members(chat_id)
+    return user_id in member_ids
+
+
+async def ais_member(chat_id: int, user_id: int) -> bool:
+    from apps.chat.db_operations import chat_database_sync_to_async
+
+    members_key, version_key = keys = get_keys(chat_id)
+    try:
+        async with get_async_redis().pipeline(transaction=False) as pipe:
+            pipe.smismember(members_key, [SENTINEL, user_id])
+            pipe.get(version_key)
+            (is_indexed, is_member_), version = await pipe.execute()
+        if is_indexed:
+            return bool(is_member_)
+        member_ids = await chat_database_sync_to_async(load_members)(chat_id)
+        await get_async_redis().eval(BUILD_SCRIPT, 2, *keys, *get_build_args(version, member_ids))
+    except redis.RedisError:
+        logger.warning("membership index unavailable, checking chat %s in the database", chat_id, exc_info=True)
+        member_ids = await chat_database_sync_to_async(load_members)(chat_id)
+    return user_id in member_ids
+
+
+def write_through(chat_id: int, command: str, user_id: int) -> None:
+    """
+    Runs after the commit, so a failure cannot be raised to the writer: the
+    set is dropped instead and rebuilt from the database on its next check.
+    """
+    try:
+        # versions outlive the sets built at them
+        get_redis().eval(
+            WRITE_THROUGH_SCRIPT, 2, *get_keys(chat_id), command, user_id, settings.CHAT_MEMBERSHIP_INDEX_TTL * 10
+        )
+    except redis.RedisError:
+        logger.warning("membership index write-through failed, dropping chat %s", chat_id, exc_info=True)
+        try:
+            invalidate(chat_id)
+        except redis.RedisError:
+            # the set goes stale until it expires
+            logger.error(
+                "membership index of chat %s could not be dropped, stale for up to %s seconds",
+                chat_id, settings.CHAT_MEMBERSHIP_INDEX_TTL, exc_info=True,
+            )
+
+
+def add(chat_id: int, user_id: int) -> None:
+    write_through(chat_id, "SADD", user_id)
+
+
+def remove(chat_id: int, user_id: int) -> None:
+    write_through(chat_id, "SREM", user_id)
+
+
+def invalidate(chat_id: int) -> None:
+    """
+    Drop the chat's set, it is rebuilt on the next check.
+    """
+    members_key, version_key = get_keys(chat_id)
+    pipe = get_redis().pipeline(transaction=True)
+    pipe.delete(members_key)
+    pipe.incr(version_key)
+    pipe.expire(version_key, settings.CHAT_MEMBERSHIP_INDEX_TTL * 10)
+    pipe.execute()
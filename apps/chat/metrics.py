@@ -0,0 +1,211 @@
+"""
+Per-event metrics of the chat sockets (settings.CHAT_METRICS_ENABLED),
+rendered in the Prometheus text format by views.metrics_view.
+
+Metrics live in the memory of each daphne process and are not aggregated
+across processes: every process has to be scraped on its own address (one
+Prometheus target per process) and summed up with sum() in the queries.
+When disabled, the consumers skip all of it.
+"""
+import bisect
+import contextvars
+import hmac
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from apps.chat import utils
+from apps.common import cache
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# event_type label of frames that are not a known EVENT_TYPE, so clients
+# cannot create series at will
+UNKNOWN_EVENT_TYPE = "unknown"
+KNOWN_EVENT_TYPES = frozenset(event_type.value for event_type in utils.ReceiveMessageEventTypesEnum)
+
+# [queries] of the event being handled, shared with the chat_db_executor
+# threads through the context sync_to_async copies
+_event_queries = contextvars.ContextVar("event_queries", default=None)
+
+
+def is_enabled() -> bool:
+    return settings.CHAT_METRICS_ENABLED
+
+
+def is_scrape_permitted(request) -> bool:
+    """
+    Whether the request carries CHAT_METRICS_TOKEN as a bearer token, or
+    comes from a staff user when no token is configured.
+    """
+    token = settings.CHAT_METRICS_TOKEN
+    if not token:
+        return request.user.is_authenticated and request.user.is_staff
+    scheme, _, credentials = request.headers.get("Authorization", "").partition(" ")
+    return scheme.lower() == "bearer" and hmac.compare_digest(credentials.encode(), token.encode())
+
+
+def inc(counter, *labelvalues):
+    if is_enabled():
+        counter.inc(*labelvalues)
+
+
+def format_labels(labelnames, labelvalues, **extra) -> str:
+    labels = [*zip(labelnames, labelvalues), *extra.items()]
+    if not labels:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.values = defaultdict(float)
+
+    def inc(self, *labelvalues, amount=1):
+        self.values[labelvalues] += amount
+
+    def samples(self):
+        for labelvalues, value in sorted(self.values.items()):
+            yield f"{self.name}_total{format_labels(self.labelnames, labelvalues)} {value}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # labelvalues -> [per-bucket counts (the last one is +Inf), sum]
+        self.values = {}
+
+    def observe(self, value, *labelvalues):
+        observed = self.values.get(labelvalues)
+        if observed is None:
+            observed = self.values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0]
+        observed[0][bisect.bisect_left(self.buckets, value)] += 1
+        observed[1] += value
+
+    def samples(self):
+        for labelvalues, (counts, total) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = format_labels(self.labelnames, labelvalues, le=bound)
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class CacheStats:
+    """
+    Counters the two-tier caches keep themselves, see apps/common/cache.py.
+    """
+    type = "counter"
+
+    def __init__(self, name, documentation, labelname, keys):
+        self.name = name
+        self.documentation = documentation
+        self.labelname = labelname
+        self.keys = keys
+
+    def samples(self):
+        for name, two_tier_cache in sorted(cache.registry.items()):
+            for key in self.keys:
+                labels = format_labels(("cache", self.labelname), (name, key))
+                yield f"{self.name}_total{labels} {two_tier_cache.stats[key]}"
+
+
+EVENT_DURATION = Histogram(
+    "chat_event_duration_seconds", "Time spent handling an incoming frame.",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+    labelnames=("event_type",),
+)
+EVENT_QUERIES = Histogram(
+    "chat_event_db_queries", "Database queries run while handling an incoming frame.",
+    buckets=(0, 1, 2, 3, 4, 5, 8, 13, 21),
+    labelnames=("event_type",),
+)
+EVENT_PAYLOAD = Histogram(
+    "chat_event_payload_bytes", "Size of an incoming frame.",
+    buckets=(64, 128, 256, 512, 1024, 4096, 16384, 65536),
+    labelnames=("event_type",),
+)
+CONNECTIONS = Counter("chat_connections", "Accepted chat sockets.", labelnames=("consumer",))
+DISCONNECTIONS = Counter("chat_disconnections", "Closed chat sockets.", labelnames=("consumer",))
+REJECTIONS = Counter("chat_rejections", "Chat sockets closed during the handshake.", labelnames=("consumer", "reason"))
+GROUP_SENDS = Counter("chat_group_sends", "group_send calls of the chat sockets.", labelnames=("type",))
+CACHE_REQUESTS = CacheStats(
+    "two_tier_cache_requests", "Lookups answered by the process, by Redis or by the database.",
+    "result", ("local_hit", "shared_hit", "miss"),
+)
+CACHE_EVENTS = CacheStats(
+    "two_tier_cache_events", "Local evictions and invalidations.", "event", ("eviction", "invalidation"),
+)
+
+REGISTRY = (
+    EVENT_DURATION, EVENT_QUERIES, EVENT_PAYLOAD, CONNECTIONS, DISCONNECTIONS, REJECTIONS, GROUP_SENDS,
+    CACHE_REQUESTS, CACHE_EVENTS,
+)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def observe_event(event_type, payload_bytes):
+    """
+    Time the handling of one frame and count its queries. Queries are
+    only counted once install_query_counter ran.
+    """
+    if event_type not in KNOWN_EVENT_TYPES:
+        event_type = UNKNOWN_EVENT_TYPE
+    queries = [0]
+    token = _event_queries.set(queries)
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        EVENT_DURATION.observe(time.perf_counter() - started, event_type)
+        _event_queries.reset(token)
+        EVENT_QUERIES.observe(queries[0], event_type)
+        EVENT_PAYLOAD.observe(payload_bytes, event_type)
+
+
+def count_query(execute, sql, params, many, context):
+    queries = _event_queries.get()
+    if queries is not None:
+        queries[0] += 1
+    return execute(sql, params, many, context)
+
+
+def install_on_connection(connection, **kwargs):
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+def install_query_counter():
+    for connection in connections.all():
+        install_on_connection(connection)
+    connection_created.connect(install_on_connection)
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:39
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_read_cursors(apps, schema_editor):
+    """
+    Start every private chat cursor at the newest message the member already
+    marked as seen. Group and channel messages have no recipient and were never
+    marked, their cursors start at the chat's newest message instead of
+    counting the whole history as unread.
+    """
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+    Message = apps.get_model("chat", "Message")
+    seen = Message.objects.filter(
+        chat_id=models.OuterRef("chat_id"),
+        recipient_id=models.OuterRef("user_id"),
+        is_seen=True,
+    ).order_by("-id")
+    ChatMembership.objects.filter(chat__type="PRIVATE").update(
+        last_read_message_id=models.Subquery(seen.values("id")[:1]),
+        last_read_at=models.Subquery(seen.values("seen_at")[:1]),
+    )
+    latest = Message.objects.filter(chat_id=models.OuterRef("chat_id")).order_by("-id")
+    ChatMembership.objects.exclude(chat__type="PRIVATE").update(
+        last_read_message_id=models.Subquery(latest.values("id")[:1]),
+        last_read_at=models.Subquery(latest.values("created_at")[:1]),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_alter_groupmembership_unique_together_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmembership',
+            name='last_read_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last Read At'),
+        ),
+        migrations.AddField(
+            model_name='chatmembership',
+            name='last_read_message',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='chat.message', verbose_name='Last Read Message'),
+        ),
+        migrations.RunPython(backfill_read_cursors, migrations.RunPython.noop),
+    ]
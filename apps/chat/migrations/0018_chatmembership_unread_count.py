@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:41
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_unread_counts(apps, schema_editor):
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+    Message = apps.get_model("chat", "Message")
+    unread = Message.objects.filter(
+        chat_id=models.OuterRef("chat_id"),
+        id__gt=Coalesce(models.OuterRef("last_read_message_id"), 0),
+        is_deleted=False,
+        deleted_at__isnull=True,
+    ).exclude(sender_id=models.OuterRef("user_id")).order_by().values("chat_id").annotate(
+        count=models.Count("id")
+    ).values("count")
+    ChatMembership.objects.update(unread_count=Coalesce(models.Subquery(unread), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_chat_last_message'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmembership',
+            name='unread_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Unread Count'),
+        ),
+        migrations.RunPython(fill_unread_counts, migrations.RunPython.noop),
+    ]
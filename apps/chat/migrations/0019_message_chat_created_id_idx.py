@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_chatmembership_unread_count'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['chat', '-created_at', '-id'], name='message_chat_created_id_idx'),
+        ),
+    ]
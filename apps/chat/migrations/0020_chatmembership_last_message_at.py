@@ -0,0 +1,42 @@
+# Generated by Django 4.2.30 on 2026-10-18 00:44
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.utils.timezone
+
+
+def fill_last_message_at(apps, schema_editor):
+    # from the messages themselves: Chat.last_message_at is only filled later,
+    # by the backfill_chat_last_message command
+    Message = apps.get_model("chat", "Message")
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+    last_message_at = Message.objects.filter(
+        chat_id=models.OuterRef("chat_id"), is_deleted=False, deleted_at__isnull=True
+    ).order_by().values("chat_id").annotate(last_message_at=models.Max("created_at")).values("last_message_at")
+    ChatMembership.objects.update(
+        last_message_at=Coalesce(models.Subquery(last_message_at), models.F("created_at"))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_message_chat_created_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmembership',
+            name='last_message_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Last Message At'),
+        ),
+        migrations.RunPython(fill_last_message_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatmembership',
+            index=models.Index(fields=['user', '-last_message_at', '-id'], name='membership_user_last_msg_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmembership',
+            index=models.Index(fields=['user', 'is_archived', '-last_message_at', '-id'], name='membership_archived_msg_idx'),
+        ),
+    ]
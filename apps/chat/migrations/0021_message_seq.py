@@ -0,0 +1,50 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:08
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+
+def fill_seqs(apps, schema_editor):
+    Chat = apps.get_model("chat", "Chat")
+    Message = apps.get_model("chat", "Message")
+    message_table = schema_editor.quote_name(Message._meta.db_table)
+    # number the existing messages of every chat in their old order
+    schema_editor.execute(
+        f"UPDATE {message_table} SET seq = numbered.seq FROM ("
+        f"SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created_at, id) AS seq "
+        f"FROM {message_table} WHERE chat_id IS NOT NULL"
+        f") AS numbered WHERE {message_table}.id = numbered.id"
+    )
+    last_seq = Message.objects.filter(chat_id=models.OuterRef("pk")).order_by().values("chat_id").annotate(
+        last_seq=models.Max("seq")
+    ).values("last_seq")
+    Chat.objects.update(last_seq=Coalesce(models.Subquery(last_seq), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_chatmembership_last_message_at'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='message',
+            name='message_chat_created_id_idx',
+        ),
+        migrations.AddField(
+            model_name='chat',
+            name='last_seq',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Last Seq'),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(blank=True, null=True, verbose_name='Seq'),
+        ),
+        migrations.RunPython(fill_seqs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='message',
+            constraint=models.UniqueConstraint(fields=('chat', 'seq'), name='message_chat_seq_uniq'),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:27
+
+from django.db import migrations, models
+from django.db.models.functions import Greatest
+
+
+def fill_last_read_seqs(apps, schema_editor):
+    Chat = apps.get_model("chat", "Chat")
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+    # the unread counters were kept per member so far, the cursor is where they start
+    last_seq = Chat.objects.filter(pk=models.OuterRef("chat_id")).values("last_seq")[:1]
+    ChatMembership.objects.update(
+        last_read_seq=Greatest(models.Subquery(last_seq) - models.F("unread_count"), models.Value(0))
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0021_message_seq'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmembership',
+            name='last_read_seq',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Last Read Seq'),
+        ),
+        migrations.RunPython(fill_last_read_seqs, migrations.RunPython.noop),
+    ]
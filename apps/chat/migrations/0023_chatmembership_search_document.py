@@ -0,0 +1,54 @@
+# Generated by Django 4.2.30 on 2026-10-18 01:43
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+BATCH_SIZE = 1000
+
+
+def fill_search_documents(apps, schema_editor):
+    """
+    The documents Chat.get_search_document builds: the chat name, or in
+    private chats the names of the other member only.
+    """
+    Chat = apps.get_model("chat", "Chat")
+    ChatMembership = apps.get_model("chat", "ChatMembership")
+
+    chat_name = Chat.objects.filter(pk=models.OuterRef("chat_id")).values("name")[:1]
+    ChatMembership.objects.exclude(chat__type="PRIVATE").update(search_document=Lower(models.Subquery(chat_name)))
+
+    memberships = ChatMembership.objects.filter(chat__type="PRIVATE").select_related("chat__user1", "chat__user2")
+    batch = []
+    for membership in memberships.iterator(chunk_size=BATCH_SIZE):
+        chat = membership.chat
+        peer = chat.user2 if membership.user_id == chat.user1_id else chat.user1
+        parts = [peer.username, peer.first_name, peer.last_name] if peer is not None else []
+        membership.search_document = " ".join(part for part in parts if part).lower()
+        batch.append(membership)
+        if len(batch) == BATCH_SIZE:
+            ChatMembership.objects.bulk_update(batch, ["search_document"])
+            batch = []
+    ChatMembership.objects.bulk_update(batch, ["search_document"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0022_chatmembership_last_read_seq'),
+        # creates the pg_trgm extension
+        ('accounts', '0017_user_search_document'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatmembership',
+            name='search_document',
+            field=models.TextField(default='', editable=False, verbose_name='Search Document'),
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='chatmembership',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='membership_search_trgm_idx', opclasses=['gin_trgm_ops']),
+        ),
+    ]
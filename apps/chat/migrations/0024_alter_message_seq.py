@@ -0,0 +1,41 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:12
+
+from django.db import migrations, models
+from django.db.models.functions import Coalesce, Greatest
+
+
+def fill_missing_seqs(apps, schema_editor):
+    Chat = apps.get_model("chat", "Chat")
+    Message = apps.get_model("chat", "Message")
+    message_table = schema_editor.quote_name(Message._meta.db_table)
+    # messages without a chat were left out by 0021, number them (and anything
+    # else still without a seq) after the last seq of their chat
+    schema_editor.execute(
+        f"UPDATE {message_table} SET seq = numbered.seq FROM ("
+        f"SELECT id, ROW_NUMBER() OVER (PARTITION BY chat_id ORDER BY created_at, id) + COALESCE(("
+        f"SELECT MAX(numbered_message.seq) FROM {message_table} AS numbered_message "
+        f"WHERE numbered_message.chat_id = message.chat_id"
+        f"), 0) AS seq "
+        f"FROM {message_table} AS message WHERE message.seq IS NULL"
+        f") AS numbered WHERE {message_table}.id = numbered.id"
+    )
+    last_seq = Message.objects.filter(chat_id=models.OuterRef("pk")).order_by().values("chat_id").annotate(
+        last_seq=models.Max("seq")
+    ).values("last_seq")
+    Chat.objects.update(last_seq=Greatest(models.F("last_seq"), Coalesce(models.Subquery(last_seq), 0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0023_chatmembership_search_document'),
+    ]
+
+    operations = [
+        migrations.RunPython(fill_missing_seqs, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='message',
+            name='seq',
+            field=models.PositiveBigIntegerField(verbose_name='Seq'),
+        ),
+    ]
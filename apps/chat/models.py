@@ -1,8 +1,10 @@
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex
 from django.db import models
 from apps.base.models import TimeStampedModel
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
-from . import managers
+from . import managers, membership_index
 
 UserModel = get_user_model()
 
@@ -18,6 +20,9 @@ class Chat(TimeStampedModel):
         verbose_name = _("Chat")
         verbose_name_plural = _("Chats")
         unique_together = ("user1", "user2")
+        indexes = [
+            models.Index(fields=["-last_message_at"], name="chat_last_message_at_idx"),
+        ]
 
     type = models.CharField(
         verbose_name=_("Type"),
@@ -60,14 +65,62 @@ class Chat(TimeStampedModel):
         null=True,
         blank=True,
     )
+    # snapshot of the newest active message, kept in the message's transaction
+    last_message = models.ForeignKey(
+        verbose_name=_("Last Message"),
+        to="chat.Message",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    last_message_at = models.DateTimeField(verbose_name=_("Last Message At"), null=True, blank=True)
+    last_message_preview = models.CharField(
+        verbose_name=_("Last Message Preview"), max_length=255, blank=True, default=""
+    )
+    last_message_sender = models.ForeignKey(
+        verbose_name=_("Last Message Sender"),
+        to="accounts.User",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    # seq of the newest message, see ChatQuerySet.allocate_seq
+    last_seq = models.PositiveBigIntegerField(verbose_name=_("Last Seq"), default=0)
+
+    objects = managers.ChatQuerySet.as_manager()
 
     def __str__(self):
         return self.name
 
     def is_permitted(self, user: UserModel) -> bool:
-        return bool(
-            self.chat_memberships.filter(user_id=user.pk).exists()
-        )
+        return membership_index.is_member(self.pk, user.pk)
+
+    @property
+    def is_broadcast(self) -> bool:
+        """
+        Channels only carry the owner's posts. A post does not touch the
+        subscribers' memberships (see ChatMembershipQuerySet.sync_broadcast_chats)
+        and members' presence, typing and read receipts are not broadcast.
+        """
+        return self.type == self.ChatTypeChoices.CHANNEL
+
+    def can_post(self, user: UserModel) -> bool:
+        return not self.is_broadcast or self.owner_id == user.pk
+
+    def get_search_document(self, member_id: int) -> str:
+        """
+        What ChatListView searches for the member: the chat name, or in
+        private chats the names of the other member only. Their name is
+        "{owner} and {user}", which would match the member's own name.
+        """
+        if self.type != self.ChatTypeChoices.PRIVATE:
+            return (self.name or "").lower()
+        peer = self.user2 if member_id == self.user1_id else self.user1
+        if peer is None:
+            return ""
+        return " ".join(part for part in (peer.username, peer.first_name, peer.last_name) if part).lower()
 
 
 class ChatMembership(TimeStampedModel):
@@ -76,6 +129,16 @@ class ChatMembership(TimeStampedModel):
         verbose_name = _("Chat Membership")
         verbose_name_plural = _("Chat Memberships")
         unique_together = ("chat", "user")
+        indexes = [
+            # keyset pagination of ChatListView, with and without the is_archived filter
+            models.Index(fields=["user", "-last_message_at", "-id"], name="membership_user_last_msg_idx"),
+            models.Index(
+                fields=["user", "is_archived", "-last_message_at", "-id"],
+                name="membership_archived_msg_idx",
+            ),
+            # substring matches of ChatMembershipQuerySet.search
+            GinIndex(fields=["search_document"], opclasses=["gin_trgm_ops"], name="membership_search_trgm_idx"),
+        ]
 
     chat = models.ForeignKey(
         verbose_name=_("Chat"),
@@ -91,12 +154,34 @@ class ChatMembership(TimeStampedModel):
     )
     is_archived = models.BooleanField(verbose_name=_("Is Archived"), default=False)
     is_muted = models.BooleanField(verbose_name=_("Is Muted"), default=False)
+    last_read_message = models.ForeignKey(
+        verbose_name=_("Last Read Message"),
+        to="chat.Message",
+        related_name="+",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    last_read_at = models.DateTimeField(verbose_name=_("Last Read At"), null=True, blank=True)
+    # seq of last_read_message, or the chat's last_seq when the member joined
+    last_read_seq = models.PositiveBigIntegerField(verbose_name=_("Last Read Seq"), default=0)
+    unread_count = models.PositiveIntegerField(verbose_name=_("Unread Count"), default=0)
+    # orders the chat list; the membership's creation time until the first message
+    last_message_at = models.DateTimeField(verbose_name=_("Last Message At"), default=timezone.now)
+    # Chat.get_search_document for the member, set on creation and refreshed
+    # by signal_handlers when the chat or the private chat's peer is renamed
+    search_document = models.TextField(verbose_name=_("Search Document"), editable=False, default="")
 
     objects = managers.ChatMembershipQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.chat} - {self.user}"
 
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            self.search_document = self.chat.get_search_document(self.user_id)
+        super().save(*args, **kwargs)
+
 
 class Message(TimeStampedModel):
     class Meta:
@@ -104,6 +189,10 @@ class Message(TimeStampedModel):
         verbose_name = _("Message")
         verbose_name_plural = _("Messages")
         ordering = ("-created_at",)
+        constraints = [
+            # also the index behind the keyset pagination of MessageListView
+            models.UniqueConstraint(fields=["chat", "seq"], name="message_chat_seq_uniq"),
+        ]
 
     class MessageTypeChoices(models.TextChoices):
         TEXT = "TEXT", _("Text")
@@ -140,6 +229,8 @@ class Message(TimeStampedModel):
         default=MessageTypeChoices.TEXT,
     )
     content = models.TextField(verbose_name=_("Content"))
+    # position of the message in its chat: 1, 2, 3, ... without gaps
+    seq = models.PositiveBigIntegerField(verbose_name=_("Seq"))
     is_seen = models.BooleanField(verbose_name=_("Is Seen"), default=False)
     seen_at = models.DateTimeField(verbose_name=_("Seen At"), null=True, blank=True)
     is_edited = models.BooleanField(verbose_name=_("Is Edited"), default=False)
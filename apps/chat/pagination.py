@@ -0,0 +1,198 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination over the per-chat seq, newest message first.
+
+    ?before=<seq>  messages older than the given one
+    ?after=<seq>   messages newer than the given one, e.g. to fill a gap
+    ?around=<seq>  the given message with older and newer ones around it
+
+    Every page costs one index range scan however deep it is.
+    """
+    limit_query_param = "limit"
+    before_query_param = "before"
+    after_query_param = "after"
+    around_query_param = "around"
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        self.has_older = False
+        self.has_newer = False
+
+        before = self.get_anchor(request, self.before_query_param)
+        after = self.get_anchor(request, self.after_query_param)
+        around = self.get_anchor(request, self.around_query_param)
+
+        if after is not None:
+            page = self.get_newer(queryset, after, self.limit)
+            self.has_older = True
+        elif around is not None:
+            older = self.get_older(queryset, around + 1, self.limit - self.limit // 2)
+            page = self.get_newer(queryset, around, self.limit // 2) + older
+        else:
+            page = self.get_older(queryset, before, self.limit)
+            self.has_newer = before is not None
+
+        self.page = page
+        return page
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def get_anchor(self, request, query_param):
+        try:
+            return int(request.query_params[query_param])
+        except (KeyError, ValueError):
+            return None
+
+    def get_older(self, queryset, seq, limit):
+        if seq is not None:
+            queryset = queryset.filter(seq__lt=seq)
+        page = list(queryset.order_by("-seq")[:limit + 1])
+        if len(page) > limit:
+            self.has_older = True
+            page = page[:limit]
+        return page
+
+    def get_newer(self, queryset, seq, limit):
+        page = list(queryset.filter(seq__gt=seq).order_by("seq")[:limit + 1])
+        if len(page) > limit:
+            self.has_newer = True
+            page = page[:limit]
+        page.reverse()
+        return page
+
+    @staticmethod
+    def get_message_seq(message):
+        # pages are model instances or .values() rows
+        return message["seq"] if isinstance(message, dict) else message.seq
+
+    def get_page_url(self, query_param, seq):
+        url = self.request.build_absolute_uri()
+        for param in (self.before_query_param, self.after_query_param, self.around_query_param):
+            url = remove_query_param(url, param)
+        return replace_query_param(url, query_param, seq)
+
+    def get_next_link(self):
+        if not self.has_older or not self.page:
+            return None
+        return self.get_page_url(self.before_query_param, self.get_message_seq(self.page[-1]))
+
+    def get_previous_link(self):
+        if not self.has_newer or not self.page:
+            return None
+        return self.get_page_url(self.after_query_param, self.get_message_seq(self.page[0]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("previous", self.get_previous_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "previous": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
+
+
+class ChatListCursorPagination(pagination.BasePagination):
+    """
+    Keyset pagination over the membership's (last_message_at, id), most
+    recently active chat first.
+
+    The cursor carries the key of the last row of the page rather than a row
+    id, so a chat that moves to the top while the client is paging is neither
+    repeated nor skipped on the following pages.
+    """
+    cursor_query_param = "cursor"
+    limit_query_param = "limit"
+    default_limit = api_settings.PAGE_SIZE
+    max_limit = 100
+    invalid_cursor_message = "Invalid cursor"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+
+        cursor = self.decode_cursor(request)
+        if cursor is not None:
+            last_message_at, membership_id = cursor
+            # the plain last_message_at bound is what makes this an index range scan
+            queryset = queryset.filter(
+                Q(last_message_at__lt=last_message_at) | Q(last_message_at=last_message_at, id__lt=membership_id),
+                last_message_at__lte=last_message_at,
+            )
+        page = list(queryset.order_by("-last_message_at", "-id")[:self.limit + 1])
+        self.has_next = len(page) > self.limit
+        self.page = page[:self.limit]
+        return self.page
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params[self.limit_query_param])
+        except (KeyError, ValueError):
+            return self.default_limit
+        return max(1, min(limit, self.max_limit))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            last_message_at, membership_id = urlsafe_b64decode(encoded.encode("ascii")).decode("ascii").split(",")
+            last_message_at = parse_datetime(last_message_at)
+            membership_id = int(membership_id)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if last_message_at is None:
+            raise NotFound(self.invalid_cursor_message)
+        return last_message_at, membership_id
+
+    def encode_cursor(self, membership):
+        cursor = f"{membership.last_message_at.isoformat()},{membership.id}"
+        return urlsafe_b64encode(cursor.encode("ascii")).decode("ascii")
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ("next", self.get_next_link()),
+            ("results", data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            "type": "object",
+            "properties": {
+                "next": {"type": "string", "nullable": True, "format": "uri"},
+                "results": schema,
+            },
+        }
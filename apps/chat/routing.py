@@ -4,4 +4,5 @@ from . import consumers
 
 websocket_urlpatterns = [
     re_path(r"ws/chat/(?P<chat_id>\w+)/$", consumers.ChatConsumer.as_asgi()),
+    re_path(r"ws/stream/$", consumers.ChatStreamConsumer.as_asgi()),
 ]
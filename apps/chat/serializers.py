@@ -1,8 +1,9 @@
 from django.db.models import Q
+from drf_yasg.utils import swagger_serializer_method
 from rest_framework import serializers
 
 from apps.accounts.models import User
-from . import models
+from . import models, utils
 
 
 class ChatCreateSerializer(serializers.ModelSerializer):
@@ -164,6 +165,8 @@ class GroupOrChannelMemberCreateSerializer(serializers.ModelSerializer):
         return chat
 
     def create(self, validated_data):
+        # posts from before joining do not count as unread
+        last_read_seq = validated_data["chat"].last_seq
         try:
             membership = models.ChatMembership.objects.get(
                 chat_id=validated_data["chat"].id,
@@ -171,9 +174,10 @@ class GroupOrChannelMemberCreateSerializer(serializers.ModelSerializer):
             )
             if membership.is_deleted:
                 membership.is_deleted = False
-                membership.save(update_fields=["is_deleted"])
+                membership.last_read_seq = last_read_seq
+                membership.save(update_fields=["is_deleted", "last_read_seq"])
         except models.ChatMembership.DoesNotExist:
-            membership = models.ChatMembership.objects.create(**validated_data)
+            membership = models.ChatMembership.objects.create(**validated_data, last_read_seq=last_read_seq)
         return membership
 
 
@@ -210,8 +214,8 @@ class ChatListSerializer(serializers.ModelSerializer):
                 return self._UserSerializer(obj.user1, context={"request": self.context["request"]}).data
             return None
 
-    chat = _ChatSerializer()
-    unseen_messages_count = serializers.IntegerField(default=0)
+    chat = serializers.SerializerMethodField()
+    unseen_messages_count = serializers.IntegerField(source="unread_count", read_only=True)
     last_message_created_at = serializers.DateTimeField(read_only=True, default=None)
     last_message_content = serializers.CharField(read_only=True, default="")
     last_message_sender_id = serializers.IntegerField(read_only=True, default=None)
@@ -224,6 +228,7 @@ class ChatListSerializer(serializers.ModelSerializer):
             "chat",
             "is_archived",
             "is_muted",
+            "unread_count",
             "unseen_messages_count",
             "last_message_created_at",
             "last_message_content",
@@ -233,6 +238,11 @@ class ChatListSerializer(serializers.ModelSerializer):
             'updated_at',
         )
 
+    @swagger_serializer_method(serializer_or_field=_ChatSerializer)
+    def get_chat(self, obj):
+        request = self.context["request"]
+        return utils.ChatDataClass.from_instance(obj.chat, request.user.id).to_dict(request)
+
 
 class ChatDetailSerializer(serializers.ModelSerializer):
     class ChatSerializer(serializers.ModelSerializer):
@@ -330,6 +340,7 @@ class MessageListSerializer(serializers.ModelSerializer):
         fields = (
             "id",
             "chat",
+            "seq",
             "type",
             "sender",
             "recipient",
@@ -0,0 +1,87 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.accounts.models import User
+from . import caches, membership_index, models, utils
+
+MEMBERSHIP_ACCESS_FIELDS = {"is_deleted", "is_archived"}
+# fields Chat.get_search_document reads from the chat and from a private chat's peer
+CHAT_SEARCH_FIELDS = {"name", "user1", "user2"}
+PEER_SEARCH_FIELDS = {"username", "first_name", "last_name"}
+
+
+def send_chat_membership_changed(chat_id: int, user_id: int, is_active: bool):
+    channel_layer = get_channel_layer()
+    async_to_sync(channel_layer.group_send)(
+        utils.get_room_group_name(chat_id), {
+            "type": "chat_membership_changed",
+            "chat_id": chat_id,
+            "user_id": user_id,
+            "is_active": is_active,
+        }
+    )
+
+
+@receiver(post_save, sender=models.ChatMembership)
+def invalidate_connection_chat_cache(sender, instance, created, update_fields=None, **kwargs):
+    """
+    Open sockets cache the chat and the permission check for their lifetime,
+    tell them to drop it when the membership is created, soft-deleted or archived.
+    """
+    if not created and update_fields is not None and not MEMBERSHIP_ACCESS_FIELDS & set(update_fields):
+        return
+    transaction.on_commit(
+        lambda: send_chat_membership_changed(instance.chat_id, instance.user_id, not instance.is_deleted)
+    )
+
+
+@receiver(post_save, sender=models.ChatMembership)
+def write_through_membership_index(sender, instance, created, update_fields=None, **kwargs):
+    if not created and update_fields is not None and "is_deleted" not in update_fields:
+        return
+    write = membership_index.remove if instance.is_deleted else membership_index.add
+    transaction.on_commit(lambda: write(instance.chat_id, instance.user_id))
+
+
+@receiver(post_delete, sender=models.ChatMembership)
+def remove_from_membership_index(sender, instance, **kwargs):
+    transaction.on_commit(lambda: membership_index.remove(instance.chat_id, instance.user_id))
+
+
+@receiver(post_delete, sender=models.ChatMembership)
+def close_deleted_membership_connections(sender, instance, **kwargs):
+    transaction.on_commit(lambda: send_chat_membership_changed(instance.chat_id, instance.user_id, False))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    transaction.on_commit(lambda: caches.users.invalidate(instance.pk))
+
+
+@receiver(post_save, sender=models.Chat)
+@receiver(post_delete, sender=models.Chat)
+def invalidate_cached_chat(sender, instance, **kwargs):
+    transaction.on_commit(lambda: caches.chats.invalidate(instance.pk))
+
+
+@receiver(post_save, sender=models.Chat)
+def refresh_chat_search_documents(sender, instance, created, update_fields=None, **kwargs):
+    # memberships of a new chat are created after it, with their document
+    if created or update_fields is not None and not CHAT_SEARCH_FIELDS & set(update_fields):
+        return
+    instance.chat_memberships.refresh_search_documents()
+
+
+@receiver(post_save, sender=User)
+def refresh_peer_search_documents(sender, instance, created, update_fields=None, **kwargs):
+    if created or update_fields is not None and not PEER_SEARCH_FIELDS & set(update_fields):
+        return
+    models.ChatMembership.objects.filter(
+        Q(chat__user1=instance) | Q(chat__user2=instance),
+        chat__type=models.Chat.ChatTypeChoices.PRIVATE,
+    ).exclude(user=instance).refresh_search_documents()
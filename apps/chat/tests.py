@@ -0,0 +1,783 @@
+import json
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlsplit
+
+import redis
+from channels.testing import WebsocketCommunicator
+from django.db import transaction
+from django.db.models import Case, Value, When
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient, APIRequestFactory
+
+from apps.accounts import presence
+from apps.accounts.models import User
+from apps.common.redis_client import get_async_redis, get_redis
+from . import caches, consumers, db_operations, event_log, membership_index, models, serializers, utils
+
+
+def get_query(url):
+    """
+    The query parameters of a next/previous link, None when there is no link.
+    """
+    if url is None:
+        return None
+    return {param: value for param, (value,) in parse_qs(urlsplit(url).query).items()}
+
+
+class MessageListQueryCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(username=f"member_{i}", email=f"member_{i}@example.com")
+            for i in range(5)
+        ]
+        cls.chat = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.users[0]
+        )
+        models.ChatMembership.objects.bulk_create(
+            [models.ChatMembership(chat=cls.chat, user=user) for user in cls.users]
+        )
+        models.Chat.objects.allocate_seq(cls.chat.id, 60)
+        models.Message.objects.bulk_create([
+            models.Message(
+                chat=cls.chat,
+                seq=i + 1,
+                sender=cls.users[i % len(cls.users)],
+                recipient=cls.users[(i + 1) % len(cls.users)],
+                content=f"message {i}",
+            )
+            for i in range(60)
+        ])
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+        self.url = reverse("message-list", kwargs={"pk": self.chat.id})
+        # chat ids are reused across test databases, start from a fresh member set
+        membership_index.invalidate(self.chat.id)
+        self.chat.is_permitted(self.users[0])
+
+    def get_page(self, limit):
+        response = self.client.get(self.url, {"limit": limit})
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_query_count_does_not_depend_on_page_size(self):
+        # chat, page, read cursors, users and the ATOMIC_REQUESTS savepoint
+        with self.assertNumQueries(6):
+            small_page = self.get_page(5)
+        with self.assertNumQueries(6):
+            large_page = self.get_page(50)
+
+        self.assertEqual(len(small_page), 5)
+        self.assertEqual(len(large_page), 50)
+
+    def test_users_are_stitched_into_every_message(self):
+        messages = self.get_page(10)
+        users = {user.id: user.username for user in self.users}
+
+        for message in messages:
+            self.assertEqual(message["sender"]["username"], users[message["sender"]["id"]])
+            self.assertEqual(message["recipient"]["username"], users[message["recipient"]["id"]])
+
+
+class MessagePaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="pager", email="pager@example.com")
+        cls.chat = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.user
+        )
+        models.ChatMembership.objects.create(chat=cls.chat, user=cls.user)
+        models.Chat.objects.allocate_seq(cls.chat.id, 10)
+        models.Message.objects.bulk_create([
+            models.Message(chat=cls.chat, seq=seq, sender=cls.user, content=f"message {seq}")
+            for seq in range(1, 11)
+        ])
+
+    def setUp(self):
+        membership_index.invalidate(self.chat.id)
+
+    def get_page(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("message-list", kwargs={"pk": self.chat.id}), {"limit": 4, **params})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return [message["seq"] for message in page["results"]], get_query(page["next"]), get_query(page["previous"])
+
+    def test_pages_go_back_through_before(self):
+        self.assertEqual(self.get_page(), ([10, 9, 8, 7], {"limit": "4", "before": "7"}, None))
+        self.assertEqual(
+            self.get_page(before=7), ([6, 5, 4, 3], {"limit": "4", "before": "3"}, {"limit": "4", "after": "6"})
+        )
+        self.assertEqual(self.get_page(before=3), ([2, 1], None, {"limit": "4", "after": "2"}))
+
+    def test_after_fills_a_gap_with_newer_messages(self):
+        self.assertEqual(
+            self.get_page(after=3), ([7, 6, 5, 4], {"limit": "4", "before": "4"}, {"limit": "4", "after": "7"})
+        )
+        self.assertEqual(self.get_page(after=8), ([10, 9], {"limit": "4", "before": "9"}, None))
+
+    def test_around_keeps_the_message_in_the_middle(self):
+        self.assertEqual(
+            self.get_page(around=5), ([7, 6, 5, 4], {"limit": "4", "before": "4"}, {"limit": "4", "after": "7"})
+        )
+
+
+class ChatListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="lister", email="lister@example.com")
+        cls.chats = [
+            models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name=f"chat {i}", owner=cls.user)
+            for i in range(3)
+        ]
+        now = timezone.now()
+        for i, chat in enumerate(cls.chats):
+            models.ChatMembership.objects.create(
+                chat=chat, user=cls.user, last_message_at=now - timedelta(minutes=i)
+            )
+
+    def get_page(self, **params):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("chat-list"), {"limit": 2, **params})
+        self.assertEqual(response.status_code, 200)
+        page = response.json()
+        return [entry["chat"]["id"] for entry in page["results"]], get_query(page["next"])
+
+    def test_most_recently_active_chats_come_first(self):
+        first_page, next_query = self.get_page()
+        self.assertEqual(first_page, [self.chats[0].id, self.chats[1].id])
+        self.assertEqual(self.get_page(**next_query), ([self.chats[2].id], None))
+
+    def test_chats_that_move_up_while_paging_are_not_repeated(self):
+        first_page, next_query = self.get_page()
+        models.ChatMembership.objects.filter(chat=self.chats[1]).update(
+            last_message_at=timezone.now() + timedelta(minutes=1)
+        )
+        self.assertEqual(self.get_page(**next_query), ([self.chats[2].id], None))
+
+    def test_invalid_cursors_are_rejected(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.get(reverse("chat-list"), {"cursor": "not a cursor"})
+        self.assertEqual(response.status_code, 404)
+
+
+class ChannelBroadcastTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner, cls.subscriber, cls.newcomer = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("owner", "subscriber", "newcomer")
+        ]
+        cls.channel = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.CHANNEL, name="channel", owner=cls.owner
+        )
+        models.ChatMembership.objects.bulk_create([
+            models.ChatMembership(chat=cls.channel, user=cls.owner),
+            models.ChatMembership(chat=cls.channel, user=cls.subscriber),
+        ])
+
+    def setUp(self):
+        membership_index.invalidate(self.channel.id)
+
+    def post(self, content):
+        with transaction.atomic():
+            message = models.Message.objects.create(
+                chat=self.channel,
+                sender=self.owner,
+                content=content,
+                seq=models.Chat.objects.allocate_seq(self.channel.id),
+            )
+            models.Chat.objects.set_last_message(message)
+        return message
+
+    def get_unread_count(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse("chat-list"))
+        self.assertEqual(response.status_code, 200)
+        entry, = [entry for entry in response.json()["results"] if entry["chat"]["id"] == self.channel.id]
+        return entry["unread_count"]
+
+    def test_posts_are_counted_on_the_next_chat_list(self):
+        first = self.post("first")
+        self.post("second")
+        self.assertEqual(self.get_unread_count(self.subscriber), 2)
+        self.assertEqual(self.get_unread_count(self.owner), 0)
+
+        models.ChatMembership.objects.advance_read_cursor(
+            chat_id=self.channel.id, user_id=self.subscriber.id, message_id=first.id, read_at=first.created_at
+        )
+        self.post("third")
+        self.assertEqual(self.get_unread_count(self.subscriber), 2)
+
+    def test_posts_before_joining_are_not_unread(self):
+        self.post("before")
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        response = client.post(
+            reverse("group-or-channel-member-create"), {"chat": self.channel.id, "user": self.newcomer.id}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.get_unread_count(self.newcomer), 0)
+
+        self.post("after")
+        self.assertEqual(self.get_unread_count(self.newcomer), 1)
+
+    def test_joining_does_not_mark_the_last_post_as_seen(self):
+        self.post("before")
+        client = APIClient()
+        client.force_authenticate(self.owner)
+        client.post(reverse("group-or-channel-member-create"), {"chat": self.channel.id, "user": self.newcomer.id})
+
+        membership = models.ChatMembership.objects.annotate_last_message().get(chat=self.channel, user=self.owner)
+        self.assertFalse(membership.last_message_is_seen)
+
+
+class EncodingEquivalenceTests(TestCase):
+    """
+    The socket events and MessageListView encode messages and chats without
+    the serializers, field for field the same.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.recipient = [
+            User.objects.create_user(
+                username=username, email=f"{username}@example.com", first_name=username.title(), last_name="Doe",
+                avatar=f"avatars/{username}.png", last_seen_at=timezone.now() - timedelta(minutes=5),
+            )
+            for username in ("sender", "recipient")
+        ]
+        cls.private = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.PRIVATE, owner=cls.sender, user1=cls.sender, user2=cls.recipient
+        )
+        cls.group = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.sender, image="chats/group.png"
+        )
+        for user in (cls.sender, cls.recipient):
+            models.ChatMembership.objects.create(chat=cls.private, user=user)
+
+        send = db_operations.save_message_to_db.func
+        cls.text = send(cls.private, cls.sender, cls.recipient, models.Message.MessageTypeChoices.TEXT.value, "text")
+        with transaction.atomic():
+            cls.file = models.Message.objects.create(
+                chat=cls.private, sender=cls.recipient, recipient=cls.sender,
+                type=models.Message.MessageTypeChoices.IMAGE, content="messages/photo.png",
+                seq=models.Chat.objects.allocate_seq(cls.private.id),
+            )
+        cls.edited = send(cls.private, cls.sender, cls.recipient, models.Message.MessageTypeChoices.TEXT.value, "draft")
+        db_operations.update_message_by_id.func(cls.edited["id"], cls.sender.id, cls.private.id, "edited")
+        cls.deleted = send(cls.private, cls.sender, cls.recipient, models.Message.MessageTypeChoices.TEXT.value, "gone")
+        db_operations.soft_delete_message.func(models.Message.objects.get(id=cls.deleted["id"]), cls.sender)
+
+    def setUp(self):
+        self.request = APIRequestFactory().get("/")
+        self.request.user = self.sender
+
+    def serialize_message(self, message_id):
+        message = models.Message.objects.select_related("sender", "recipient").get(id=message_id)
+        message.is_own_message = message.sender_id == self.sender.id
+        data = serializers.MessageDetailSerializer(message, context={"request": self.request}).data
+        return json.loads(json.dumps(data))
+
+    def test_messages(self):
+        message_ids = [self.text["id"], self.file.id, self.edited["id"], self.deleted["id"]]
+        rows = {
+            row["id"]: row
+            for row in models.Message.objects.filter(id__in=message_ids).annotate(
+                is_own_message=Case(When(sender_id=self.sender.id, then=Value(True)), default=Value(False))
+            ).values(*utils.MessageDataClass.VALUES_FIELDS, "is_own_message")
+        }
+        for message_id in message_ids:
+            with self.subTest(message_id=message_id):
+                expected = self.serialize_message(message_id)
+                message = models.Message.objects.select_related("sender", "recipient").get(id=message_id)
+                message.is_own_message = message.sender_id == self.sender.id
+                event = {"message": utils.MessageDataClass.from_instance(message).to_dict(self.request)}
+                self.assertEqual(json.loads(utils.encode_event(event))["message"], expected)
+                row, = utils.MessageDataClass.from_values([rows[message_id]])
+                self.assertEqual(json.loads(utils.encode_event(row.to_dict(self.request))), expected)
+
+    def test_message_list(self):
+        client = APIClient()
+        client.force_authenticate(self.sender)
+        response = client.get(reverse("message-list", kwargs={"pk": self.private.id}))
+        self.assertEqual(response.status_code, 200)
+        # nobody read anything, so the read cursors agree with the stored is_seen
+        self.assertEqual(
+            response.json()["results"],
+            [self.serialize_message(message_id) for message_id in (self.edited["id"], self.file.id, self.text["id"])],
+        )
+
+    def test_chats(self):
+        for chat in (self.private, self.group):
+            with self.subTest(chat=chat.type):
+                expected = serializers.ChatListSerializer._ChatSerializer(chat, context={"request": self.request}).data
+                encoded = utils.ChatDataClass.from_instance(chat, self.sender.id).to_dict(self.request)
+                self.assertEqual(json.loads(utils.encode_event(encoded)), json.loads(json.dumps(expected)))
+
+
+class MessageAdminTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(username="admin", email="admin@example.com", password="pass")
+        cls.member = User.objects.create_user(username="member", email="member@example.com")
+        cls.chat = models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.admin)
+        for user in (cls.admin, cls.member):
+            models.ChatMembership.objects.create(chat=cls.chat, user=user)
+
+    def test_added_messages_take_the_next_seq(self):
+        self.client.force_login(self.admin)
+        for content in ("first", "second"):
+            response = self.client.post(reverse("admin:chat_message_add"), {
+                "chat": self.chat.id, "sender": self.admin.id, "recipient": self.member.id, "type": "TEXT",
+                "content": content,
+            })
+            self.assertEqual(response.status_code, 302)
+
+        self.assertEqual(list(self.chat.messages.order_by("seq").values_list("content", "seq")), [
+            ("first", 1), ("second", 2),
+        ])
+        self.chat.refresh_from_db()
+        self.assertEqual((self.chat.last_seq, self.chat.last_message_preview), (2, "second"))
+        self.assertEqual(models.ChatMembership.objects.get(chat=self.chat, user=self.member).unread_count, 2)
+
+
+class UnreadCountTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.reader, cls.idler = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("sender", "reader", "idler")
+        ]
+        cls.chat = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.sender
+        )
+        for user in (cls.sender, cls.reader, cls.idler):
+            models.ChatMembership.objects.create(chat=cls.chat, user=user)
+
+    def send(self, content):
+        message = db_operations.save_message_to_db.func(
+            self.chat, self.sender, None, models.Message.MessageTypeChoices.TEXT.value, content
+        )
+        return models.Message.objects.get(id=message["id"])
+
+    def get_unread_counts(self):
+        return dict(models.ChatMembership.objects.filter(chat=self.chat).values_list("user_id", "unread_count"))
+
+    def test_messages_are_unread_for_everyone_but_the_sender(self):
+        self.send("first")
+        self.send("second")
+        self.assertEqual(
+            self.get_unread_counts(), {self.sender.id: 0, self.reader.id: 2, self.idler.id: 2}
+        )
+
+    def test_deleted_messages_are_taken_off_the_counts_of_members_that_had_not_read_them(self):
+        first = self.send("first")
+        second = self.send("second")
+        models.ChatMembership.objects.advance_read_cursor(
+            chat_id=self.chat.id, user_id=self.reader.id, message_id=first.id, read_at=first.created_at
+        )
+
+        self.assertTrue(db_operations.soft_delete_message.func(first, self.sender))
+        self.assertEqual(self.get_unread_counts(), {self.sender.id: 0, self.reader.id: 1, self.idler.id: 1})
+        self.assertTrue(db_operations.soft_delete_message.func(second, self.sender))
+        self.assertEqual(self.get_unread_counts(), {self.sender.id: 0, self.reader.id: 0, self.idler.id: 0})
+
+    def test_deleting_a_message_twice_counts_once(self):
+        self.send("first")
+        second = self.send("second")
+
+        self.assertTrue(db_operations.soft_delete_message.func(second, self.sender))
+        self.assertFalse(db_operations.soft_delete_message.func(second, self.sender))
+        self.assertEqual(self.get_unread_counts()[self.idler.id], 1)
+
+
+class ReadCursorTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sender, cls.reader = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("sender", "reader")
+        ]
+        cls.chat, cls.other_chat = [
+            models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name=name, owner=cls.sender)
+            for name in ("group", "other")
+        ]
+        for chat in (cls.chat, cls.other_chat):
+            for user in (cls.sender, cls.reader):
+                models.ChatMembership.objects.create(chat=chat, user=user)
+
+    def send(self, sender, content, chat=None):
+        message = db_operations.save_message_to_db.func(
+            chat or self.chat, sender, None, models.Message.MessageTypeChoices.TEXT.value, content
+        )
+        return models.Message.objects.get(id=message["id"])
+
+    def read(self, message):
+        return db_operations.mark_chat_as_read.func(self.chat.id, self.reader.id, message.id)
+
+    def get_cursor(self):
+        return models.ChatMembership.objects.values("last_read_message_id", "last_read_seq", "unread_count").get(
+            chat=self.chat, user=self.reader
+        )
+
+    def test_cursor_only_moves_forward(self):
+        first, second, third = [self.send(self.sender, content) for content in ("first", "second", "third")]
+
+        receipt = self.read(second)
+        self.assertEqual(receipt["last_read_message_id"], second.id)
+        self.assertEqual(
+            self.get_cursor(), {"last_read_message_id": second.id, "last_read_seq": second.seq, "unread_count": 1}
+        )
+
+        self.assertIsNone(self.read(first))
+        self.assertIsNone(self.read(second))
+        self.assertEqual(self.get_cursor()["last_read_seq"], second.seq)
+
+        self.read(third)
+        self.assertEqual(self.get_cursor()["unread_count"], 0)
+
+    def test_unread_count_leaves_out_own_and_deleted_messages(self):
+        first = self.send(self.sender, "first")
+        self.send(self.reader, "own")
+        deleted = self.send(self.sender, "deleted")
+        db_operations.soft_delete_message.func(deleted, self.sender)
+        self.send(self.sender, "unread")
+
+        self.read(first)
+        self.assertEqual(self.get_cursor()["unread_count"], 1)
+
+    def test_messages_of_other_chats_do_not_move_the_cursor(self):
+        self.send(self.sender, "first")
+        elsewhere = self.send(self.sender, "elsewhere", chat=self.other_chat)
+
+        self.assertIsNone(self.read(elsewhere))
+        self.assertEqual(self.get_cursor(), {"last_read_message_id": None, "last_read_seq": 0, "unread_count": 1})
+
+
+class MembershipIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.member, cls.outsider = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("member", "outsider")
+        ]
+        cls.chat = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.member
+        )
+        models.ChatMembership.objects.bulk_create([models.ChatMembership(chat=cls.chat, user=cls.member)])
+
+    def setUp(self):
+        membership_index.invalidate(self.chat.id)
+
+    def test_checks_are_served_from_the_index(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(self.chat.is_permitted(self.member))
+        with self.assertNumQueries(0):
+            self.assertTrue(self.chat.is_permitted(self.member))
+            self.assertFalse(self.chat.is_permitted(self.outsider))
+
+    def test_membership_changes_are_written_through(self):
+        self.chat.is_permitted(self.member)
+        with self.captureOnCommitCallbacks(execute=True):
+            membership = models.ChatMembership.objects.create(chat=self.chat, user=self.outsider)
+        with self.assertNumQueries(0):
+            self.assertTrue(self.chat.is_permitted(self.outsider))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            membership.soft_delete()
+        with self.assertNumQueries(0):
+            self.assertFalse(self.chat.is_permitted(self.outsider))
+
+    def test_rebuild_that_raced_a_membership_change_is_not_stored(self):
+        load_members = membership_index.load_members
+
+        def load_members_then_join(chat_id):
+            member_ids = load_members(chat_id)
+            # the outsider joins after the reader loaded the members
+            membership_index.add(chat_id, self.outsider.id)
+            return member_ids
+
+        with mock.patch.object(membership_index, "load_members", load_members_then_join):
+            self.assertFalse(self.chat.is_permitted(self.outsider))
+        with mock.patch.object(membership_index, "load_members", lambda chat_id: [self.member.id, self.outsider.id]):
+            self.assertTrue(self.chat.is_permitted(self.outsider))
+
+    def test_failed_write_through_drops_the_set(self):
+        self.chat.is_permitted(self.member)
+        members_key, version_key = membership_index.get_keys(self.chat.id)
+        version = int(get_redis().get(version_key))
+        with mock.patch.object(get_redis(), "eval", side_effect=redis.ConnectionError), \
+                self.assertLogs(membership_index.logger, "WARNING"), \
+                self.captureOnCommitCallbacks(execute=True):
+            models.ChatMembership.objects.create(chat=self.chat, user=self.outsider)
+
+        self.assertFalse(get_redis().exists(members_key))
+        self.assertEqual(int(get_redis().get(version_key)), version + 1)
+        with self.assertNumQueries(1):
+            self.assertTrue(self.chat.is_permitted(self.outsider))
+
+
+class EventReplayTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="returning", email="returning@example.com")
+        cls.chat = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="group", owner=cls.user
+        )
+        models.ChatMembership.objects.create(chat=cls.chat, user=cls.user)
+
+    def setUp(self):
+        get_redis().delete(event_log.EVENTS_KEY.format(chat_id=self.chat.id))
+        # the sockets would load the members and the chat on their own database
+        # threads, which do not see the test's transaction, so both are cached
+        membership_index.invalidate(self.chat.id)
+        self.chat.is_permitted(self.user)
+        caches.chats.invalidate(self.chat.id)
+        caches.chats.get(self.chat.id)
+
+    async def log_events(self, count):
+        return [
+            await event_log.append(self.chat.id, {
+                "type": "send_private_chat_message",
+                "EVENT_TYPE": utils.SendMessageEventTypesEnum.CHAT_SEND_MESSAGE.value,
+                "chat_id": self.chat.id,
+                "message": {"content": f"message {i}"},
+            })
+            for i in range(count)
+        ]
+
+    async def connect(self, consumer, path):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        communicator.scope["user"] = self.user
+        communicator.scope["url_route"] = {"kwargs": {"chat_id": str(self.chat.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def receive_all(self, communicator):
+        events = []
+        while not await communicator.receive_nothing(timeout=0.2):
+            events.append(json.loads(await communicator.receive_from()))
+        await communicator.disconnect()
+        return [event for event in events if event["EVENT_TYPE"] != "private_chat_online_status"]
+
+    async def test_chat_socket_replays_the_events_after_last_event_id(self):
+        event_ids = await self.log_events(3)
+        communicator = await self.connect(
+            consumers.ChatConsumer, f"/ws/chat/{self.chat.id}/?last_event_id={event_ids[0]}"
+        )
+        events = await self.receive_all(communicator)
+        self.assertEqual([event["event_id"] for event in events], event_ids[1:])
+        self.assertEqual(events[0]["message"], {"content": "message 1"})
+
+    async def test_stream_subscription_replays_the_events_after_last_event_id(self):
+        event_ids = await self.log_events(2)
+        communicator = await self.connect(consumers.ChatStreamConsumer, "/ws/stream/")
+        await communicator.send_to(text_data=json.dumps({
+            "EVENT_TYPE": "subscribe_chat", "chat_id": self.chat.id, "last_event_id": event_ids[0],
+        }))
+        subscribed, *events = await self.receive_all(communicator)
+        self.assertTrue(subscribed["is_subscribed"])
+        self.assertEqual([event["event_id"] for event in events], event_ids[1:])
+
+    async def test_resync_is_required_when_the_log_no_longer_reaches_back(self):
+        event_ids = await self.log_events(3)
+        await get_async_redis().xtrim(event_log.EVENTS_KEY.format(chat_id=self.chat.id), maxlen=1, approximate=False)
+
+        for last_event_id in (event_ids[0], "not-an-event-id"):
+            communicator = await self.connect(
+                consumers.ChatConsumer, f"/ws/chat/{self.chat.id}/?last_event_id={last_event_id}"
+            )
+            events = await self.receive_all(communicator)
+            self.assertEqual(events, [{"EVENT_TYPE": "resync_required", "chat_id": self.chat.id}])
+
+
+class RejectedEventTests(TransactionTestCase):
+    """
+    The sockets run their queries on database threads of their own, the rows
+    have to be committed for them.
+    """
+
+    def setUp(self):
+        self.user, self.other = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("member", "other")
+        ]
+        self.chat, self.other_chat = [
+            models.Chat.objects.create(type=models.Chat.ChatTypeChoices.GROUP, name=name, owner=self.user)
+            for name in ("group", "other")
+        ]
+        for chat in (self.chat, self.other_chat):
+            models.ChatMembership.objects.create(chat=chat, user=self.user)
+            membership_index.invalidate(chat.id)
+            caches.chats.invalidate(chat.id)
+            get_redis().delete(event_log.EVENTS_KEY.format(chat_id=chat.id))
+        # a message the member may edit and delete, but in another chat
+        self.elsewhere = models.Message.objects.create(
+            chat=self.other_chat, sender=self.user, recipient=self.other, content="elsewhere",
+            seq=models.Chat.objects.allocate_seq(self.other_chat.id),
+        )
+
+    async def test_frames_about_other_chats_or_missing_messages_are_not_logged(self):
+        communicator = await self.connect(consumers.ChatConsumer, f"/ws/chat/{self.chat.id}/")
+        await communicator.receive_from()  # the member's own online status
+
+        for frame in (
+            {"EVENT_TYPE": "private_chat_edit_message", "message_id": self.elsewhere.id, "message_text": "edited"},
+            {"EVENT_TYPE": "private_chat_message_delete", "message_id": self.elsewhere.id},
+            {"EVENT_TYPE": "private_chat_see_message", "message_id": self.elsewhere.id},
+            {"EVENT_TYPE": "private_chat_edit_message", "message_id": self.elsewhere.id + 1, "message_text": "x"},
+        ):
+            await communicator.send_to(text_data=json.dumps(frame))
+        self.assertTrue(await communicator.receive_nothing(timeout=0.5))
+        await communicator.disconnect()
+
+        self.assertEqual(await get_async_redis().xlen(event_log.EVENTS_KEY.format(chat_id=self.chat.id)), 0)
+        elsewhere = await models.Message.objects.aget(id=self.elsewhere.id)
+        self.assertEqual((elsewhere.content, elsewhere.is_deleted), ("elsewhere", False))
+
+    async def connect(self, consumer, path):
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path)
+        communicator.scope["user"] = self.user
+        communicator.scope["url_route"] = {"kwargs": {"chat_id": str(self.chat.id)}}
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def assert_unsupported(self, event, event_type, chat_id=None):
+        self.assertEqual(event, {
+            "EVENT_TYPE": "error", "error": "unsupported_event", "event_type": event_type, "chat_id": chat_id,
+        })
+
+    async def test_chat_socket_answers_unknown_frames_with_an_error(self):
+        communicator = await self.connect(consumers.ChatConsumer, f"/ws/chat/{self.chat.id}/")
+        await communicator.receive_from()  # the member's own online status
+
+        await communicator.send_to(text_data=json.dumps({"EVENT_TYPE": "no_such_event"}))
+        self.assert_unsupported(json.loads(await communicator.receive_from()), "no_such_event")
+        await communicator.disconnect()
+
+    async def test_heartbeats_refresh_the_presence_without_an_answer(self):
+        for consumer, path in (
+            (consumers.ChatConsumer, f"/ws/chat/{self.chat.id}/"), (consumers.ChatStreamConsumer, "/ws/stream/"),
+        ):
+            with self.subTest(consumer=consumer.__name__):
+                communicator = await self.connect(consumer, path)
+                while not await communicator.receive_nothing(timeout=0.2):
+                    await communicator.receive_from()  # the chat socket's online status
+                # as if flush() had pruned the user
+                await get_async_redis().zrem(presence.ONLINE_KEY, self.user.id)
+
+                await communicator.send_to(text_data=json.dumps({"EVENT_TYPE": "heartbeat"}))
+                self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+                self.assertIsNotNone(await get_async_redis().zscore(presence.ONLINE_KEY, self.user.id))
+                await communicator.disconnect()
+
+    async def test_stream_socket_answers_unknown_and_unsubscribed_frames_with_an_error(self):
+        communicator = await self.connect(consumers.ChatStreamConsumer, "/ws/stream/")
+
+        await communicator.send_to(text_data=json.dumps({"EVENT_TYPE": "no_such_event", "chat_id": self.chat.id}))
+        self.assert_unsupported(json.loads(await communicator.receive_from()), "no_such_event", self.chat.id)
+        await communicator.send_to(text_data=json.dumps({"EVENT_TYPE": "no_such_event"}))
+        self.assert_unsupported(json.loads(await communicator.receive_from()), "no_such_event")
+        # a chat the socket never subscribed to
+        await communicator.send_to(text_data=json.dumps({
+            "EVENT_TYPE": "private_chat_send_message", "chat_id": self.other_chat.id, "message": "hi",
+        }))
+        self.assert_unsupported(
+            json.loads(await communicator.receive_from()), "private_chat_send_message", self.other_chat.id
+        )
+        await communicator.disconnect()
+
+
+class ChatCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="cached", email="cached@example.com")
+
+    def setUp(self):
+        caches.users.invalidate(self.user.pk)
+
+    def test_lookups_are_served_from_the_cache(self):
+        with self.assertNumQueries(1):
+            caches.users.get(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(caches.users.get(self.user.pk).username, "cached")
+
+    def test_saved_rows_are_invalidated(self):
+        caches.users.get(self.user.pk)
+        self.user.first_name = "Renamed"
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.save()
+        self.assertEqual(caches.users.get(self.user.pk).first_name, "Renamed")
+
+
+class ChatListSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice, cls.bob = [
+            User.objects.create_user(username=username, email=f"{username}@example.com")
+            for username in ("alice", "bob")
+        ]
+        cls.private = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.PRIVATE, name="alice and bob",
+            owner=cls.alice, user1=cls.alice, user2=cls.bob,
+        )
+        cls.group = models.Chat.objects.create(
+            type=models.Chat.ChatTypeChoices.GROUP, name="Release Planning", owner=cls.alice
+        )
+        for chat, user in ((cls.private, cls.alice), (cls.private, cls.bob), (cls.group, cls.alice)):
+            models.ChatMembership.objects.create(chat=chat, user=user)
+
+    def search(self, term):
+        client = APIClient()
+        client.force_authenticate(self.alice)
+        response = client.get(reverse("chat-list"), {"search": term})
+        self.assertEqual(response.status_code, 200)
+        return [entry["chat"]["id"] for entry in response.json()["results"]]
+
+    def test_chats_are_found_by_name_and_by_the_peer(self):
+        self.assertEqual(self.search("planning"), [self.group.id])
+        self.assertEqual(self.search("bob"), [self.private.id])
+
+    def test_private_chats_are_not_found_by_the_members_own_name(self):
+        self.assertEqual(self.search("alice"), [])
+
+    def test_renamed_peers_are_found_by_their_new_name(self):
+        self.bob.first_name = "Robert"
+        self.bob.save(update_fields=["first_name"])
+        self.assertEqual(self.search("robert"), [self.private.id])
+
+
+@override_settings(CHAT_METRICS_ENABLED=True, CHAT_METRICS_TOKEN="")
+class MetricsViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username="member", email="member@example.com")
+        cls.staff = User.objects.create_user(username="staff", email="staff@example.com", is_staff=True)
+
+    def test_only_staff_may_scrape_without_a_token(self):
+        self.assertEqual(self.client.get(reverse("chat-metrics")).status_code, 403)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse("chat-metrics")).status_code, 403)
+        self.client.force_login(self.staff)
+        self.assertEqual(self.client.get(reverse("chat-metrics")).status_code, 200)
+
+    @override_settings(CHAT_METRICS_TOKEN="scrape-token")
+    def test_the_scraper_sends_the_token(self):
+        url = reverse("chat-metrics")
+        self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION="Bearer wrong").status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        response = self.client.get(url, HTTP_AUTHORIZATION="Bearer scrape-token")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("# TYPE chat_connections counter", response.content.decode())
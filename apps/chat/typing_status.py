@@ -0,0 +1,49 @@
+"""
+Typing status of every user in every chat, coalesced in Redis across all of
+the user's connections, whichever process they are on.
+
+Each connection refreshes TYPING_KEY (holding its channel name, so the last
+connection to refresh owns it) at most once per CHAT_TYPING_INTERVAL while its
+client types, and "is_typing": true goes out only when SENT_KEY was not set
+by any of them within the interval. When a connection stops typing,
+"is_typing": false goes out unless another connection of the user has
+refreshed the status since.
+"""
+from django.conf import settings
+
+from apps.common.redis_client import get_async_redis
+
+TYPING_KEY = "chat:typing:{chat_id}:{user_id}"
+SENT_KEY = "chat:typing:{chat_id}:{user_id}:sent"
+
+STOP_SCRIPT = """
+local owner = redis.call('GET', KEYS[1])
+if owner and owner ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[1], KEYS[2])
+return 1
+"""
+
+
+def get_keys(chat_id: int, user_id: int) -> list:
+    return [TYPING_KEY.format(chat_id=chat_id, user_id=user_id), SENT_KEY.format(chat_id=chat_id, user_id=user_id)]
+
+
+async def refresh(chat_id: int, user_id: int, channel_name: str) -> bool:
+    """
+    Returns whether "is_typing": true has to be sent.
+    """
+    typing_key, sent_key = get_keys(chat_id, user_id)
+    async with get_async_redis().pipeline(transaction=False) as pipe:
+        pipe.set(typing_key, channel_name, px=int(settings.CHAT_TYPING_TIMEOUT * 1000))
+        pipe.set(sent_key, 1, px=int(settings.CHAT_TYPING_INTERVAL * 1000), nx=True)
+        _, is_due = await pipe.execute()
+    return bool(is_due)
+
+
+async def stop(chat_id: int, user_id: int, channel_name: str) -> bool:
+    """
+    Returns whether "is_typing": false has to be sent.
+    """
+    return bool(await get_async_redis().eval(STOP_SCRIPT, 2, *get_keys(chat_id, user_id), channel_name))
@@ -35,4 +35,5 @@ urlpatterns = [
         views.ChatMembershipUpdateAPIView.as_view(),
         name="chatMembershipUpdate"
     ),
+    path("metrics/", views.metrics_view, name="chat-metrics"),
 ]
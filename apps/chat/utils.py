@@ -1,5 +1,19 @@
-from enum import Enum
+import json
 from dataclasses import dataclass
+from datetime import datetime
+from enum import Enum
+from typing import ClassVar, Optional
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from rest_framework import ISO_8601
+from rest_framework.settings import api_settings
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
 
 
 class SendMessageEventTypesEnum(Enum):
@@ -9,6 +23,15 @@ class SendMessageEventTypesEnum(Enum):
     PRIVATE_CHAT_SEE_MESSAGE = 'private_chat_see_message'
     PRIVATE_CHAT_EDIT_MESSAGE = 'private_chat_edit_message'
     PRIVATE_CHAT_MESSAGE_DELETE = 'private_chat_message_delete'
+    CHAT_READ_MESSAGES = 'chat_read_messages'
+    SUBSCRIBE_CHAT = 'subscribe_chat'
+    UNSUBSCRIBE_CHAT = 'unsubscribe_chat'
+    # sent to the sender only, once a write-behind message is (or failed to be) stored
+    MESSAGE_PERSISTED = 'message_persisted'
+    # a frame the socket does not handle, sent back to its sender only
+    ERROR = 'error'
+    # the events missed since the client's last_event_id are no longer logged
+    RESYNC_REQUIRED = 'resync_required'
 
     GROUP_CHAT_SEND_MESSAGE = 'group_chat_send_message'
 
@@ -20,18 +43,259 @@ class ReceiveMessageEventTypesEnum(Enum):
     PRIVATE_CHAT_SEE_MESSAGE = 'private_chat_see_message'
     PRIVATE_CHAT_EDIT_MESSAGE = 'private_chat_edit_message'
     PRIVATE_CHAT_MESSAGE_DELETE = 'private_chat_message_delete'
+    # "I have read everything up to message_id"
+    CHAT_READ_MESSAGES = 'chat_read_messages'
+    SUBSCRIBE_CHAT = 'subscribe_chat'
+    UNSUBSCRIBE_CHAT = 'unsubscribe_chat'
+    HEARTBEAT = 'heartbeat'
+
+
+def get_room_name(chat_id) -> str:
+    return 'private_chat_{chat_id}'.format(chat_id=chat_id)
+
+
+def get_room_group_name(chat_id) -> str:
+    return "group_%s" % get_room_name(chat_id)
+
+
+def encode_event(event: dict) -> str:
+    """
+    Encode an outgoing websocket event once, at the group_send site.
+    Uses orjson when it is installed and falls back to the stdlib json module.
+    """
+    if orjson is not None:
+        return orjson.dumps(event).decode()
+    return json.dumps(event)
+
+
+def format_datetime(value: Optional[datetime]) -> Optional[str]:
+    """
+    Same output as rest_framework.fields.DateTimeField with the project's
+    DATETIME_FORMAT.
+    """
+    if not value:
+        return None
+    if api_settings.DATETIME_FORMAT is None:
+        return value
+    value = timezone.localtime(value) if settings.USE_TZ else value
+    if api_settings.DATETIME_FORMAT.lower() == ISO_8601:
+        value = value.isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return value.strftime(api_settings.DATETIME_FORMAT)
+
+
+def file_url(name: Optional[str], request=None) -> Optional[str]:
+    """
+    Same output as rest_framework.fields.FileField for a stored file name.
+    """
+    if not name:
+        return None
+    url = default_storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def is_read_by_others(sender_id: Optional[int], seq: Optional[int], read_cursors) -> bool:
+    """
+    Whether a member other than the sender has read the message at seq.
+    read_cursors is ChatMembershipQuerySet.read_cursors() of the message's chat.
+    """
+    if seq is None:
+        return False
+    for user_id, last_read_seq in read_cursors:
+        if user_id != sender_id:
+            return last_read_seq >= seq
+    return False
+
+
+# The dataclasses below encode the hot websocket/REST payloads without DRF
+# field introspection. They are built from .values() rows (or model
+# instances) and produce the same dicts as the matching serializers:
+# UserStubDataClass.to_dict -> MessageListSerializer.UserSerializer
+# UserStubDataClass.to_chat_dict -> ChatListSerializer._ChatSerializer._UserSerializer
+# MessageDataClass.to_dict -> MessageListSerializer / MessageDetailSerializer
+# ChatDataClass.to_dict -> ChatListSerializer._ChatSerializer
 
+@dataclass(slots=True)
+class UserStubDataClass:
+    VALUES_FIELDS: ClassVar[tuple] = ("id", "username", "avatar", "first_name", "last_name", "last_seen_at")
 
-@dataclass
+    id: int
+    username: str
+    avatar: Optional[str]
+    first_name: str
+    last_name: str
+    last_seen_at: Optional[datetime]
+
+    @classmethod
+    def from_instance(cls, user) -> "UserStubDataClass":
+        return cls(
+            id=user.id,
+            username=user.username,
+            avatar=user.avatar.name if user.avatar else None,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            last_seen_at=user.last_seen_at,
+        )
+
+    @classmethod
+    def load(cls, user_ids) -> dict:
+        """
+        {user_id: UserStubDataClass} for the given ids, in one query.
+        """
+        from apps.accounts.models import User
+
+        user_ids = set(user_ids)
+        user_ids.discard(None)
+        if not user_ids:
+            return {}
+        return {
+            row["id"]: cls(**row)
+            for row in User.objects.filter(id__in=user_ids).values(*cls.VALUES_FIELDS)
+        }
+
+    def to_dict(self, request=None) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "avatar": file_url(self.avatar, request),
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "last_seen_at": format_datetime(self.last_seen_at),
+        }
+
+    def to_chat_dict(self, request=None) -> dict:
+        return {
+            "id": self.id,
+            "username": self.username,
+            "full_name": f"{self.first_name} {self.last_name}".strip(),
+            "avatar": file_url(self.avatar, request),
+        }
+
+
+@dataclass(slots=True)
 class MessageDataClass:
+    VALUES_FIELDS: ClassVar[tuple] = (
+        "id", "chat_id", "seq", "type", "sender_id", "recipient_id", "content",
+        "is_seen", "seen_at", "is_edited", "is_reacted", "created_at",
+    )
+
     id: int
-    chat_id: int
-    sender_id: int
-    recipient_id: int
-    text: str
-    file: str
+    chat_id: Optional[int]
+    seq: Optional[int]
+    type: str
+    sender: Optional[UserStubDataClass]
+    recipient: Optional[UserStubDataClass]
+    content: str
     is_seen: bool
-    seen_at: str
+    seen_at: Optional[datetime]
+    is_edited: bool
+    is_reacted: bool
+    created_at: datetime
+    is_own_message: bool = False
+
+    @classmethod
+    def from_instance(cls, message) -> "MessageDataClass":
+        """
+        The message's sender and recipient must already be loaded.
+        """
+        return cls(
+            id=message.id,
+            chat_id=message.chat_id,
+            seq=message.seq,
+            type=message.type,
+            sender=UserStubDataClass.from_instance(message.sender) if message.sender_id else None,
+            recipient=UserStubDataClass.from_instance(message.recipient) if message.recipient_id else None,
+            content=message.content,
+            is_seen=message.is_seen,
+            seen_at=message.seen_at,
+            is_edited=message.is_edited,
+            is_reacted=message.is_reacted,
+            created_at=message.created_at,
+            is_own_message=bool(getattr(message, "is_own_message", False)),
+        )
+
+    @classmethod
+    def from_values(cls, rows) -> list:
+        """
+        Builds messages from .values(*VALUES_FIELDS) rows, optionally with an
+        is_own_message annotation, loading their users in one query.
+        """
+        users = UserStubDataClass.load(
+            user_id for row in rows for user_id in (row["sender_id"], row["recipient_id"])
+        )
+        return [
+            cls(
+                id=row["id"],
+                chat_id=row["chat_id"],
+                seq=row["seq"],
+                type=row["type"],
+                sender=users.get(row["sender_id"]),
+                recipient=users.get(row["recipient_id"]),
+                content=row["content"],
+                is_seen=row["is_seen"],
+                seen_at=row["seen_at"],
+                is_edited=row["is_edited"],
+                is_reacted=row["is_reacted"],
+                created_at=row["created_at"],
+                is_own_message=bool(row.get("is_own_message", False)),
+            )
+            for row in rows
+        ]
+
+    def to_dict(self, request=None) -> dict:
+        return {
+            "id": self.id,
+            "chat": self.chat_id,
+            "seq": self.seq,
+            "type": self.type,
+            "sender": self.sender.to_dict(request) if self.sender is not None else None,
+            "recipient": self.recipient.to_dict(request) if self.recipient is not None else None,
+            "content": self.content,
+            "is_seen": self.is_seen,
+            "seen_at": format_datetime(self.seen_at),
+            "is_edited": self.is_edited,
+            "is_reacted": self.is_reacted,
+            "created_at": format_datetime(self.created_at),
+            "is_own_message": self.is_own_message,
+        }
+
+
+@dataclass(slots=True)
+class ChatDataClass:
+    id: int
+    name: str
+    image: Optional[str]
+    type: Optional[str]
+    user: Optional[UserStubDataClass]
+
+    @classmethod
+    def from_instance(cls, chat, user_id: int) -> "ChatDataClass":
+        """
+        user is the other member of a private chat, as seen by user_id.
+        """
+        peer = None
+        if chat.type == chat.ChatTypeChoices.PRIVATE:
+            peer = chat.user2 if chat.user1_id == user_id else chat.user1
+        return cls(
+            id=chat.id,
+            name=chat.name,
+            image=chat.image.name if chat.image else None,
+            type=chat.type,
+            user=UserStubDataClass.from_instance(peer) if peer is not None else None,
+        )
+
+    def to_dict(self, request=None) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "image": file_url(self.image, request),
+            "type": self.type,
+            "user": self.user.to_chat_dict(request) if self.user is not None else None,
+        }
 
 
 class UserActionEnum(Enum):
@@ -1,7 +1,11 @@
 from django.db.models import Case, When, BooleanField, Value
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
 from rest_framework import generics, permissions, exceptions, filters
+from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
-from . import models, serializers
+from . import metrics, models, pagination, serializers, utils
+from .filters import SearchDocumentFilter
 
 
 class ChatCreateView(generics.CreateAPIView):
@@ -37,15 +41,17 @@ class ChannelCreateView(generics.CreateAPIView):
 class ChatListView(generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
     serializer_class = serializers.ChatListSerializer
-    filter_backends = (DjangoFilterBackend, filters.SearchFilter)
+    filter_backends = (DjangoFilterBackend, SearchDocumentFilter)
     filterset_fields = ("is_archived",)
-    search_fields = ("chat__name", 'chat__members__first_name', 'chat__members__last_name',)
+    pagination_class = pagination.ChatListCursorPagination
 
     def get_queryset(self):
         qs = self.request.user.chat_memberships.all().select_related("chat")
-        qs = qs.annotate_last_message(outer_ref_name="chat_id")
-        qs = qs.annotate_unseen_messages_count(self.request.user)
-        return qs.order_by("-last_message_created_at", "-updated_at")
+        return qs.annotate_last_message()
+
+    def list(self, request, *args, **kwargs):
+        request.user.chat_memberships.sync_broadcast_chats()
+        return super().list(request, *args, **kwargs)
 
 
 class ChatDetailView(generics.RetrieveAPIView):
@@ -80,6 +86,7 @@ class MessageListView(generics.ListAPIView):
     filter_backends = (DjangoFilterBackend, filters.SearchFilter)
     search_fields = ("content",)
     queryset = models.Message.objects.active()
+    pagination_class = pagination.MessageCursorPagination
 
     def get_queryset(self):
         chat = models.Chat.objects.filter(id=self.kwargs.get("pk")).first()
@@ -96,4 +103,33 @@ class MessageListView(generics.ListAPIView):
                 output_field=BooleanField(),
             )
         )
-        return qs.order_by("-created_at")
+        return qs.order_by("-seq")
+
+    def list(self, request, *args, **kwargs):
+        # encoded straight from .values() rows, see utils.MessageDataClass
+        queryset = self.filter_queryset(self.get_queryset())
+        queryset = queryset.values(*utils.MessageDataClass.VALUES_FIELDS, "is_own_message")
+        page = self.paginate_queryset(queryset)
+        messages = utils.MessageDataClass.from_values(page if page is not None else list(queryset))
+        if messages:
+            # is_seen comes from the members' read cursors, not the per-message flag
+            read_cursors = models.ChatMembership.objects.read_cursors(self.kwargs.get("pk"))
+            for message in messages:
+                sender_id = message.sender.id if message.sender is not None else None
+                message.is_seen = utils.is_read_by_others(sender_id, message.seq, read_cursors)
+        data = [message.to_dict(request) for message in messages]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+
+def metrics_view(request):
+    """
+    Prometheus scrape endpoint of this process, 404 unless CHAT_METRICS_ENABLED.
+    Only the scraper holding CHAT_METRICS_TOKEN and staff users may read it.
+    """
+    if not metrics.is_enabled():
+        raise Http404
+    if not metrics.is_scrape_permitted(request):
+        raise PermissionDenied
+    return HttpResponse(metrics.render(), content_type=metrics.CONTENT_TYPE)
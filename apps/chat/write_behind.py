@@ -0,0 +1,205 @@
+"""
+Write-behind persistence for chat messages (settings.CHAT_WRITE_BEHIND).
+
+A message gets its id (from the message id sequence, reserved in blocks) and
+its timestamps when it is received, so it can be broadcast right away. The
+rows are inserted later by one flusher task per process, every
+CHAT_WRITE_BEHIND_FLUSH_MS or as soon as CHAT_WRITE_BEHIND_BATCH_SIZE messages
+are waiting, together with the chat snapshot and unread count updates.
+
+Every process reserves its own blocks of ids, so the ids of a chat's messages
+are not in the order they were sent once several processes accept messages
+for it. Only seqs order a chat: they are allocated at flush time under the
+chat row lock, and read cursors and unread counts compare seqs, never ids.
+
+Because of that the broadcast carries "seq": null. Clients skip messages
+without a seq when they look for gaps between seqs; the sender learns the
+seq from the message_persisted event it gets once the message is committed
+(or given up on), the other members when they page the history. Messages
+still buffered when a process dies are lost, which is what the ack is for.
+"""
+import asyncio
+import contextvars
+import logging
+import weakref
+from collections import deque
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import DatabaseError, connection, transaction
+from django.utils import timezone
+
+from apps.chat import db_operations, models, utils
+
+logger = logging.getLogger(__name__)
+
+# one buffer per event loop, i.e. per daphne process
+_buffers = weakref.WeakKeyDictionary()
+
+
+def is_enabled() -> bool:
+    return settings.CHAT_WRITE_BEHIND and connection.vendor == "postgresql"
+
+
+def get_buffer() -> "MessageWriteBehindBuffer":
+    loop = asyncio.get_running_loop()
+    buffer = _buffers.get(loop)
+    if buffer is None:
+        buffer = MessageWriteBehindBuffer()
+        _buffers[loop] = buffer
+    return buffer
+
+
+@db_operations.chat_database_sync_to_async
+def reserve_message_ids(count: int) -> list:
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT nextval(pg_get_serial_sequence(%s, 'id')) FROM generate_series(1, %s)",
+            [models.Message._meta.db_table, count],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def insert_messages(messages) -> None:
+    """
+    Give the messages their seqs, insert them and update their chats. Call
+    inside a transaction.
+    """
+    messages_by_chat = {}
+    for message in messages:
+        messages_by_chat.setdefault(message.chat_id, []).append(message)
+    # chat rows are locked in id order so concurrent flushes cannot deadlock
+    for chat_id in sorted(messages_by_chat):
+        chat_messages = messages_by_chat[chat_id]
+        last_seq = models.Chat.objects.allocate_seq(chat_id, len(chat_messages))
+        for seq, message in enumerate(chat_messages, start=last_seq - len(chat_messages) + 1):
+            message.seq = seq
+
+    # a raw insert keeps the created_at/updated_at assigned up front, which
+    # bulk_create would overwrite through auto_now_add/auto_now
+    models.Message._base_manager._insert(
+        messages, fields=models.Message._meta.concrete_fields, raw=True
+    )
+    for chat_messages in messages_by_chat.values():
+        models.Chat.objects.set_last_message(chat_messages[-1])
+        if not chat_messages[0].chat.is_broadcast:
+            models.ChatMembership.objects.apply_new_messages(chat_messages)
+
+
+@db_operations.chat_database_sync_to_async
+def persist_messages(messages) -> list:
+    """
+    Returns the ids of the messages that were written. A failing batch is
+    retried one message at a time so one bad row does not sink the others.
+    """
+    try:
+        with transaction.atomic():
+            insert_messages(messages)
+        return [message.id for message in messages]
+    except DatabaseError:
+        logger.exception("Bulk insert of %d messages failed, retrying one by one", len(messages))
+
+    persisted = []
+    for message in messages:
+        try:
+            with transaction.atomic():
+                insert_messages([message])
+        except DatabaseError:
+            logger.exception("Dropping message %s of chat %s", message.id, message.chat_id)
+        else:
+            persisted.append(message.id)
+    return persisted
+
+
+class MessageWriteBehindBuffer:
+    def __init__(self):
+        self.pending = []
+        self.reply_channels = {}
+        self.reserved_ids = deque()
+        self.accept_lock = asyncio.Lock()
+        self.flush_lock = asyncio.Lock()
+        self.wakeup = None
+        self.flusher = None
+
+    async def save_message(self, chat: models.Chat, sndr, rcpt, msg_type, content, reply_channel=None) -> dict | None:
+        """
+        Same contract as db_operations.save_message_to_db, but returns before
+        the message is written.
+        """
+        if msg_type != models.Message.MessageTypeChoices.TEXT.value:
+            return None
+        if self.flusher is None or self.flusher.done():
+            # a fresh context, not the one of the frame that happened to start
+            # it (see metrics.observe_event)
+            self.flusher = contextvars.Context().run(asyncio.create_task, self.run())
+
+        async with self.accept_lock:
+            if not self.reserved_ids:
+                self.reserved_ids.extend(await reserve_message_ids(settings.CHAT_WRITE_BEHIND_BATCH_SIZE))
+            now = timezone.now()
+            msg = models.Message(
+                id=self.reserved_ids.popleft(),
+                chat=chat,
+                sender=sndr,
+                recipient=rcpt,
+                type=msg_type,
+                content=content,
+                created_at=now,
+                updated_at=now,
+            )
+            self.pending.append(msg)
+            if reply_channel is not None:
+                self.reply_channels[msg.id] = reply_channel
+
+        if len(self.pending) >= settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+            self.wake_up()
+        return utils.MessageDataClass.from_instance(msg).to_dict()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if len(self.pending) < settings.CHAT_WRITE_BEHIND_BATCH_SIZE:
+                # a plain future rather than wait_for(), which can swallow
+                # the task's cancellation when it races the timeout
+                self.wakeup = loop.create_future()
+                timer = loop.call_later(settings.CHAT_WRITE_BEHIND_FLUSH_MS / 1000, self.wake_up)
+                try:
+                    await self.wakeup
+                finally:
+                    timer.cancel()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Message flush failed")
+
+    def wake_up(self):
+        if self.wakeup is not None and not self.wakeup.done():
+            self.wakeup.set_result(None)
+
+    async def flush(self) -> None:
+        """
+        Write everything accepted so far and ack it to the senders.
+        """
+        async with self.flush_lock:
+            while self.pending:
+                batch = self.pending[:settings.CHAT_WRITE_BEHIND_BATCH_SIZE]
+                del self.pending[:len(batch)]
+                persisted = set(await persist_messages(batch))
+                await self.send_acks(batch, persisted)
+
+    async def send_acks(self, batch, persisted) -> None:
+        channel_layer = get_channel_layer()
+        for msg in batch:
+            reply_channel = self.reply_channels.pop(msg.id, None)
+            if reply_channel is None:
+                continue
+            await channel_layer.send(reply_channel, {
+                "type": "message_persisted",
+                "text": utils.encode_event({
+                    "EVENT_TYPE": utils.SendMessageEventTypesEnum.MESSAGE_PERSISTED.value,
+                    "chat_id": msg.chat_id,
+                    "message_id": msg.id,
+                    "seq": msg.seq if msg.id in persisted else None,
+                    "is_persisted": msg.id in persisted,
+                }),
+            })
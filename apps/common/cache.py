@@ -0,0 +1,189 @@
+"""
+Model instances by primary key in two tiers: a bounded LRU in every process
+in front of the configured Django cache (Redis), in front of the database.
+
+Saving or deleting a row must call invalidate(), usually from a post_save /
+post_delete receiver. It bumps the row's version in the shared tier, so entries
+written by readers that raced the change no longer match, and publishes the
+primary key to every process, which drops it from its LRU. A process whose
+listener lost its connection may have missed messages and clears its LRU once
+it is subscribed again, local entries also expire after local_ttl seconds.
+
+Writes that bypass the signals (queryset.update) are only picked up when the
+entries expire, do not rely on denormalized counters of cached instances.
+"""
+import copy
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import redis
+from django.core.cache import caches
+
+from apps.common.redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+INVALIDATE_CHANNEL = "two_tier_cache:invalidate"
+# seconds the listener waits before resubscribing after a Redis error
+RECONNECT_DELAY = 1.0
+
+# returned by get_local() when the process does not have the instance
+MISSING = object()
+
+# name -> TwoTierCache, for the listener and the metrics
+registry = {}
+
+_listener = None
+_listener_lock = threading.Lock()
+
+
+class TwoTierCache:
+    def __init__(self, name, model, maxsize, local_ttl, ttl, cache_alias="default"):
+        self.name = name
+        self.model = model
+        self.maxsize = maxsize
+        self.local_ttl = local_ttl
+        self.ttl = ttl
+        self.cache_alias = cache_alias
+        # pickled instances of an older schema are never read back
+        fields = ",".join(sorted(field.attname for field in model._meta.concrete_fields))
+        self.prefix = f"{name}:{hashlib.md5(fields.encode()).hexdigest()[:8]}"
+
+        self.lock = threading.Lock()
+        # pk -> (expires_at, instance), least recently used first
+        self.local = OrderedDict()
+        # bumped on every invalidation, a load that started before one is not kept
+        self.generation = 0
+        self.stats = dict.fromkeys(("local_hit", "shared_hit", "miss", "eviction", "invalidation"), 0)
+        registry[name] = self
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def version_key(self, pk) -> str:
+        return f"{self.prefix}:version:{pk}"
+
+    def value_key(self, pk) -> str:
+        return f"{self.prefix}:{pk}"
+
+    def get_local(self, pk):
+        """
+        A copy of the instance if this process has it, MISSING otherwise.
+        Never touches Redis or the database, so it is safe on the event loop.
+        """
+        pk = self.model._meta.pk.to_python(pk)
+        with self.lock:
+            entry = self.local.get(pk)
+            if entry is None:
+                return MISSING
+            if entry[0] < time.monotonic():
+                del self.local[pk]
+                return MISSING
+            self.local.move_to_end(pk)
+            self.stats["local_hit"] += 1
+        return copy.copy(entry[1])
+
+    def get(self, pk):
+        """
+        A copy of the instance with primary key pk, None if there is none.
+        """
+        instance = self.get_local(pk)
+        if instance is not MISSING:
+            return instance
+        ensure_listening()
+        pk = self.model._meta.pk.to_python(pk)
+        generation = self.generation
+
+        try:
+            instance = self.get_shared(pk)
+        except redis.RedisError:
+            logger.warning("%s cache unavailable, loading %s from the database", self.name, pk, exc_info=True)
+            return self.model._default_manager.filter(pk=pk).first()
+        if instance is None:
+            return None
+
+        with self.lock:
+            if generation == self.generation:
+                self.local[pk] = (time.monotonic() + self.local_ttl, instance)
+                self.local.move_to_end(pk)
+                if len(self.local) > self.maxsize:
+                    self.local.popitem(last=False)
+                    self.stats["eviction"] += 1
+        return copy.copy(instance)
+
+    def get_shared(self, pk):
+        version_key, value_key = self.version_key(pk), self.value_key(pk)
+        found = self.cache.get_many([version_key, value_key])
+        version = found.get(version_key, 0)
+        stamped = found.get(value_key)
+        if stamped is not None and stamped[0] == version:
+            self.stats["shared_hit"] += 1
+            return stamped[1]
+
+        self.stats["miss"] += 1
+        instance = self.model._default_manager.filter(pk=pk).first()
+        if instance is not None:
+            self.cache.set(value_key, (version, instance), self.ttl)
+        return instance
+
+    def drop(self, pk):
+        with self.lock:
+            self.generation += 1
+            self.local.pop(pk, None)
+
+    def clear_local(self):
+        with self.lock:
+            self.generation += 1
+            self.local.clear()
+
+    def invalidate(self, pk):
+        """
+        Drop the instance in every process. Call once the change is committed.
+        """
+        pk = self.model._meta.pk.to_python(pk)
+        self.stats["invalidation"] += 1
+        self.drop(pk)
+        version_key = self.version_key(pk)
+        # versions outlive the values stamped with them
+        self.cache.add(version_key, 0, self.ttl * 10)
+        self.cache.incr(version_key)
+        self.cache.delete(self.value_key(pk))
+        get_redis().publish(INVALIDATE_CHANNEL, json.dumps({"cache": self.name, "pk": pk}))
+
+
+def listen():
+    while True:
+        pubsub = get_redis().pubsub(ignore_subscribe_messages=True)
+        try:
+            pubsub.subscribe(INVALIDATE_CHANNEL)
+            # whatever was published before the subscription is lost
+            for cache in registry.values():
+                cache.clear_local()
+            for message in pubsub.listen():
+                data = json.loads(message["data"])
+                cache = registry.get(data["cache"])
+                if cache is not None:
+                    cache.drop(data["pk"])
+        except redis.RedisError:
+            logger.warning("cache invalidation listener disconnected", exc_info=True)
+            time.sleep(RECONNECT_DELAY)
+        finally:
+            pubsub.close()
+
+
+def ensure_listening():
+    """
+    Start the invalidation listener of this process, again after a fork.
+    """
+    global _listener
+    if _listener is not None and _listener.is_alive():
+        return
+    with _listener_lock:
+        if _listener is None or not _listener.is_alive():
+            _listener = threading.Thread(target=listen, name="two-tier-cache", daemon=True)
+            _listener.start()
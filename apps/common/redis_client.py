@@ -0,0 +1,26 @@
+import asyncio
+import weakref
+
+import redis
+from redis import asyncio as aioredis
+from django.conf import settings
+
+_client = None
+# redis.asyncio connections are bound to the event loop that created them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_redis() -> redis.Redis:
+    global _client
+    if _client is None:
+        _client = redis.Redis.from_url(settings.REDIS_URL)
+    return _client
+
+
+def get_async_redis() -> aioredis.Redis:
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = aioredis.Redis.from_url(settings.REDIS_URL)
+        _async_clients[loop] = client
+    return client
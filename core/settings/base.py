@@ -34,6 +34,7 @@ DJANGO_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
 ]
 
 CUSTOM_APPS = [
@@ -113,9 +114,19 @@ DATABASES = {
         "HOST": env.str("DB_HOST"),
         "PORT": env.str("DB_PORT"),
         "ATOMIC_REQUESTS": True,
+        "CONN_MAX_AGE": env.int("DB_CONN_MAX_AGE", 60),
+        "CONN_HEALTH_CHECKS": True,
     }
 }
 
+# Worker threads (and so DB connections) each daphne process uses for chat sockets
+CHAT_DB_EXECUTOR_WORKERS = env.int("CHAT_DB_EXECUTOR_WORKERS", 8)
+# Broadcast chat messages before they are written and insert them in batches,
+# see apps/chat/write_behind.py. PostgreSQL only.
+CHAT_WRITE_BEHIND = env.bool("CHAT_WRITE_BEHIND", False)
+CHAT_WRITE_BEHIND_FLUSH_MS = env.int("CHAT_WRITE_BEHIND_FLUSH_MS", 5)
+CHAT_WRITE_BEHIND_BATCH_SIZE = env.int("CHAT_WRITE_BEHIND_BATCH_SIZE", 200)
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -166,6 +177,9 @@ CORS_ALLOW_ALL_ORIGINS = True
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
+# REDIS
+REDIS_URL = env.str("REDIS_URL", "redis://localhost:6379/0")
+
 # CACHES
 CACHES = {
     "default": {
@@ -175,17 +189,85 @@ CACHES = {
     }
 }
 
+# ACCOUNTS CACHES
+# serialized profiles and search results of the user list and profile
+# endpoints, see apps/accounts/caches.py
+ACCOUNTS_PROFILE_CACHE_TTL = env.int("ACCOUNTS_PROFILE_CACHE_TTL", 60 * 60)
+ACCOUNTS_SEARCH_CACHE_TTL = env.int("ACCOUNTS_SEARCH_CACHE_TTL", 10 * 60)
+# searches with more results are paginated in the database
+ACCOUNTS_SEARCH_CACHE_MAX_IDS = env.int("ACCOUNTS_SEARCH_CACHE_MAX_IDS", 5_000)
+# shortest word /api/accounts/search/ needs, shorter ones have no trigrams to look up
+USER_SEARCH_MIN_LENGTH = env.int("USER_SEARCH_MIN_LENGTH", 3)
+
 # CELERY CONFIGURATION
 CELERY_BROKER_URL = env.str("CELERY_BROKER_URL", "redis://localhost:6379")
 CELERY_RESULT_BACKEND = env.str("CELERY_BROKER_URL", "redis://localhost:6379")
 CELERY_TIMEZONE = "Asia/Tashkent"
 CELERY_TASK_TRACK_STARTED = True
 CELERY_TASK_TIME_LIMIT = 30 * 60
+CELERY_BEAT_SCHEDULE = {
+    "flush_presence_task": {
+        "task": "flush_presence_task",
+        "schedule": env.int("PRESENCE_FLUSH_INTERVAL", 15),
+        "options": {"queue": "lightweight-tasks"},
+    },
+}
+
+# PRESENCE
+# seconds a connection counts as alive without a heartbeat
+PRESENCE_TTL = env.int("PRESENCE_TTL", 120)
+# seconds between the heartbeats an open connection sends, well below PRESENCE_TTL
+PRESENCE_HEARTBEAT_INTERVAL = env.int("PRESENCE_HEARTBEAT_INTERVAL", 30)
+
+# TYPING STATUS
+# seconds between "is_typing": true events of one user in one chat
+CHAT_TYPING_INTERVAL = env.float("CHAT_TYPING_INTERVAL", 3.0)
+# seconds without a typing frame after which "is_typing": false is sent
+CHAT_TYPING_TIMEOUT = env.float("CHAT_TYPING_TIMEOUT", 6.0)
+
+# CHAT METRICS
+# per-event timings, query counts and socket counters of the chat sockets,
+# scraped from /api/chat/metrics/ (see apps/chat/metrics.py). The scraper
+# sends "Authorization: Bearer <CHAT_METRICS_TOKEN>", without a token only
+# staff users are let in. Every daphne process keeps its own metrics, so each
+# one has to be scraped on its own address and summed up by Prometheus.
+CHAT_METRICS_ENABLED = env.bool("CHAT_METRICS_ENABLED", False)
+CHAT_METRICS_TOKEN = env.str("CHAT_METRICS_TOKEN", "")
+
+# CHAT CACHES
+# users and chats of the chat sockets, see apps/chat/caches.py: entries each
+# process keeps, seconds it keeps them and seconds Redis keeps them
+CHAT_CACHE_LOCAL_MAXSIZE = env.int("CHAT_CACHE_LOCAL_MAXSIZE", 10_000)
+CHAT_CACHE_LOCAL_TTL = env.int("CHAT_CACHE_LOCAL_TTL", 60)
+CHAT_CACHE_TTL = env.int("CHAT_CACHE_TTL", 5 * 60)
+
+# CHAT MEMBERSHIP INDEX
+# seconds a chat's member set is kept in Redis before it is rebuilt,
+# see apps/chat/membership_index.py
+CHAT_MEMBERSHIP_INDEX_TTL = env.int("CHAT_MEMBERSHIP_INDEX_TTL", 60 * 60)
+
+# CHAT EVENT LOG
+# events kept per chat for replay on reconnect, see apps/chat/event_log.py
+CHAT_EVENT_LOG_MAXLEN = env.int("CHAT_EVENT_LOG_MAXLEN", 500)
+# seconds the log of an idle chat is kept
+CHAT_EVENT_LOG_TTL = env.int("CHAT_EVENT_LOG_TTL", 24 * 60 * 60)
 
 # CHANNEL LAYERS
+# With the pub/sub layer a group_send is one PUBLISH that every process with
+# members in the group receives once and fans out to its local channels. The
+# list-based core layer reads the whole group and writes one message per
+# process on every group_send, but keeps messages for consumers that are busy
+# or reconnecting. Pub/sub delivery is fire-and-forget: those consumers lose
+# the events and their clients have to catch up from the event log. Opt in
+# only after measuring with the bench_group_fanout command on the real Redis.
+CHANNEL_LAYER_PUBSUB = env.bool("CHANNEL_LAYER_PUBSUB", False)
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": (
+            "channels_redis.pubsub.RedisPubSubChannelLayer"
+            if CHANNEL_LAYER_PUBSUB else
+            "channels_redis.core.RedisChannelLayer"
+        ),
         "CONFIG": {
             "hosts": [env.str("REDIS_URL", "redis://localhost:6379")],
         },